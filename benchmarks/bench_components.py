@@ -0,0 +1,64 @@
+"""Memory footprint of components
+
+    python -m benchmarks.bench_components [--n 10000]
+
+Builds n components of a few widget classes in one session, as table-like
+apps do, and reports the memory still allocated per component once the
+messages announcing them are flushed, and the time to build one.
+"""
+from pyplet.primitives import Session
+from pyplet.widgets import Slider, TextArea, Image
+from tests.conftest import NullSocket
+
+import tracemalloc
+import argparse
+import asyncio
+import time
+import gc
+
+
+def listening_slider():
+    slider = Slider()
+    slider.on_change(print, "value", trigger=False)
+    return slider
+
+
+async def build(session, factory, n):
+    with session:
+        components = [factory() for _ in range(n)]
+    await asyncio.sleep(0)                             # Flushes the outbox
+    return components
+
+
+async def measure(factory, n):
+    session = Session(0, NullSocket())
+    start = time.perf_counter()
+    components = await build(session, factory, n)
+    elapsed = time.perf_counter() - start
+    del components
+    gc.collect()
+    await asyncio.sleep(0)
+
+    session = Session(0, NullSocket())
+    tracemalloc.start()
+    components = await build(session, factory, n)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / n, elapsed / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", default=10000, type=int)
+    args = parser.parse_args()
+
+    print("{:<20}{:>14}{:>14}".format("component", "bytes", "us"))
+    for name, factory in [("Slider", Slider), ("TextArea", TextArea), ("Image", Image),
+                          ("Slider + on_change", listening_slider)]:
+        size, elapsed = asyncio.run(measure(factory, args.n))
+        print("{:<20}{:>14.0f}{:>14.1f}".format(name, size, elapsed*1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Micro-benchmark of the image conversions of pyplet.feed
+
+    python -m benchmarks.bench_rgba [--size 1024]
+
+Reports the time per conversion and the peak of memory allocated during it,
+with and without a preallocated output buffer, along with the time of the
+former implementation (RGBA only). The latter returned CHW images in a
+channel-planar layout, leaving the interleaving to the encoder: its time once
+made contiguous is reported too.
+"""
+from pyplet.feed import img_to_rgba, arrays_to_rgba
+
+import numpy as np
+
+import tracemalloc
+import argparse
+import timeit
+
+
+def former_img_to_rgba(image, scale=1, CHW=False):
+    if len(image.shape) == 2:
+        image = image[...,None]
+    elif CHW:
+        image = np.moveaxis(image, 0, 2)
+    if scale != 1:
+        image = image*scale
+    if image.dtype != np.uint8:
+        image = image.astype(np.uint8)
+    if image.shape[-1] == 1:
+        image = np.tile(image, [1, 1, 3])
+    if image.shape[-1] == 2:
+        image = np.concatenate((image,
+                                np.zeros([*image.shape[:2], 1], dtype=np.uint8)),
+                               axis=-1)
+    if image.shape[-1] == 3:
+        image = np.concatenate((image, 255*np.ones(image.shape[:-1], dtype=np.uint8)[...,None]), axis=-1)
+    return image
+
+
+def inputs(size):
+    rng = np.random.default_rng(0)
+    uint8 = lambda *shape: rng.integers(0, 256, shape, dtype=np.uint8)
+    return [
+        ("HW uint8",        uint8(size, size),          dict()),
+        ("HW float",        rng.random((size, size)),     dict(scale=255)),
+        ("HWC uint8",       uint8(size, size, 3),       dict()),
+        ("HWC float",       rng.random((size, size, 3)),  dict(scale=255)),
+        ("HWC float32",     rng.random((size, size, 3), dtype=np.float32), dict(scale=255)),
+        ("CHW uint8",       uint8(3, size, size),       dict(CHW=True)),
+        ("CHW float",       rng.random((3, size, size)),  dict(CHW=True, scale=255)),
+    ]
+
+
+def measure(f, number):
+    tracemalloc.start()
+    f()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(timeit.repeat(f, number=number, repeat=3)) / number, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", default=1024, type=int)
+    parser.add_argument("--number", default=10, type=int)
+    args = parser.parse_args()
+
+    row = "{:<14}{:>8}{:>12}{:>14}{:>10}{:>10}{:>10}"
+    print(row.format("input", "alpha", "former ms", "(contiguous)", "ms", "ms (out)", "peak MB"))
+    for name, image, kwargs in inputs(args.size):
+        for alpha in (True, False):
+            out = np.empty((args.size, args.size, 4 if alpha else 3), np.uint8)
+            former = contiguous = "-"
+            if alpha:
+                former = measure(lambda: former_img_to_rgba(image, **kwargs), args.number)[0]
+                contiguous = measure(lambda: np.ascontiguousarray(former_img_to_rgba(image, **kwargs)),
+                                     args.number)[0]
+                former, contiguous = "{:.2f}".format(former*1e3), "{:.2f}".format(contiguous*1e3)
+            fresh, _ = measure(lambda: img_to_rgba(image, alpha=alpha, **kwargs), args.number)
+            reused, peak = measure(lambda: img_to_rgba(image, alpha=alpha, out=out, **kwargs), args.number)
+            print(row.format(name, str(alpha), former, contiguous, "{:.2f}".format(fresh*1e3),
+                             "{:.2f}".format(reused*1e3), "{:.2f}".format(peak/2**20)))
+
+    plane = np.random.default_rng(0).random((args.size, args.size))
+    out = np.empty((args.size, args.size, 4), np.uint8)
+    fresh, _ = measure(lambda: arrays_to_rgba(r=plane, g=plane, scale=255), args.number)
+    reused, peak = measure(lambda: arrays_to_rgba(r=plane, g=plane, scale=255, out=out), args.number)
+    print(row.format("arrays float", "True", "-", "-", "{:.2f}".format(fresh*1e3),
+                     "{:.2f}".format(reused*1e3), "{:.2f}".format(peak/2**20)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Load test of the server, run in-process against the example apps
+
+    python -m benchmarks.bench_server [--clients 20] [--events 50] [--output results.json]
+
+Each of the concurrent websocket clients opens a session of an app, waits for
+it to settle, then sends user events to its sliders, selects, text areas and
+buttons, one at a time. Reports per app:
+- the session open latency, until the first frame of the app,
+- the messages, frames and bytes received per second during the events,
+- the round trip latency from a user event to the first state change after it,
+- the resident memory added per open session. Clients run in the same
+  process as the server, so it includes their (small) share.
+Results are also written as JSON, to track regressions.
+"""
+from pyplet.server import make_app, executor_type
+
+import tornado.httpserver
+import tornado.websocket
+import tornado.testing
+import tornado.ioloop
+
+import statistics
+import platform
+import argparse
+import asyncio
+import random
+import glob
+import json
+import time
+import os
+
+
+def synthetic_event(clss, state, i):
+    """A user event for a component of the view clss, or None"""
+    name = clss.rsplit(".", 1)[-1]
+    if name == "SliderView":
+        return {"value": random.randint(state.get("min", 0), state.get("max", 100))}
+    if name == "SelectView" and state.get("options"):
+        return {"value": random.choice(state["options"])}
+    if name == "TextAreaView":
+        return {"value": "event {}".format(i)}
+    if name == "ButtonView":
+        return {"click": None}
+    return None
+
+
+def rss():
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def summary(values):
+    if not values:
+        return None
+    values = sorted(values)
+    return {"mean": statistics.mean(values), "p50": values[len(values)//2],
+            "p95": values[int(len(values)*0.95)], "max": values[-1]}
+
+
+class Client:
+    def __init__(self, url, packed):
+        self.url = url
+        self.packed = packed
+        self.components = {}                           # comp_id -> [clss, state]
+        self.messages = self.frames = self.bytes = 0
+
+    async def open(self):
+        start = time.perf_counter()
+        self.ws = await tornado.websocket.websocket_connect(
+            self.url, subprotocols=["pyplet.msgpack" if self.packed else "pyplet.json"])
+        await self.read(None)
+        return time.perf_counter() - start
+
+    def close(self):
+        self.ws.close()
+
+    async def read(self, timeout):
+        """Reads a frame, returns the types of its messages"""
+        frame = await asyncio.wait_for(self.ws.read_message(), timeout)
+        if frame is None:
+            raise ConnectionError("session closed")
+        self.frames += 1
+        self.bytes += len(frame)
+        if isinstance(frame, bytes) and not self.packed:
+            self.messages += 1
+            return ["blob"]
+        if self.packed:
+            import msgpack
+            frame = msgpack.unpackb(frame, raw=False)
+        else:
+            frame = json.loads(frame)
+        messages = frame if isinstance(frame, list) else [frame]
+        self.messages += len(messages)
+        for message in messages:
+            if message["type"] == "new":
+                self.components[message["comp_id"]] = [message["clss"], {}]
+            elif message["type"] == "state_change" and message["comp_id"] in self.components:
+                self.components[message["comp_id"]][1].update(message["state_change"])
+            elif message["type"] == "delete":
+                self.components.pop(message["comp_id"], None)
+        return [message["type"] for message in messages]
+
+    async def settle(self, quiet=0.2):
+        """Reads until no frame arrives for quiet seconds"""
+        try:
+            while True:
+                await self.read(quiet)
+        except asyncio.TimeoutError:
+            pass
+
+    async def send_events(self, n, timeout):
+        latencies, timeouts = [], 0
+        for i in range(n):
+            targets = [(comp_id, synthetic_event(clss, state, i))
+                       for comp_id, (clss, state) in self.components.items()]
+            targets = [(comp_id, event) for comp_id, event in targets if event is not None]
+            if not targets:
+                break
+            comp_id, event = random.choice(targets)
+            message = {"type": "user_event", "comp_id": comp_id, "user_event": event}
+            start = time.perf_counter()
+            if self.packed:
+                import msgpack
+                self.ws.write_message(msgpack.packb(message), binary=True)
+            else:
+                self.ws.write_message(json.dumps(message))
+            deadline = start + timeout
+            try:
+                while "state_change" not in await self.read(max(0, deadline - time.perf_counter())):
+                    pass
+                latencies.append(time.perf_counter() - start)
+            except asyncio.TimeoutError:
+                timeouts += 1
+            # Let the app finish its reaction before the next event
+            await self.settle(0.01)
+        return latencies, timeouts
+
+
+async def bench_app(port, app, args):
+    url = "ws://127.0.0.1:{}/websocket/{}".format(port, app)
+    clients = [Client(url, args.encoding == "msgpack") for _ in range(args.clients)]
+    before = rss()
+    open_latencies = await asyncio.gather(*(client.open() for client in clients))
+    await asyncio.gather(*(client.settle() for client in clients))
+    after = rss()
+    for client in clients:
+        client.messages = client.frames = client.bytes = 0
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(client.send_events(args.events, args.timeout) for client in clients))
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.close()
+
+    latencies = [latency for client_latencies, _ in results for latency in client_latencies]
+    return {
+        "app": app,
+        "open_latency_ms": summary([latency*1e3 for latency in open_latencies]),
+        "events": len(latencies) + sum(timeouts for _, timeouts in results),
+        "timeouts": sum(timeouts for _, timeouts in results),
+        "roundtrip_ms": summary([latency*1e3 for latency in latencies]),
+        "messages_per_s": sum(client.messages for client in clients) / elapsed,
+        "frames_per_s": sum(client.frames for client in clients) / elapsed,
+        "bytes_per_s": sum(client.bytes for client in clients) / elapsed,
+        "rss_per_session_mb": (after - before) / len(clients) / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apps", default="examples/app_*.py")
+    parser.add_argument("--clients", default=20, type=int)
+    parser.add_argument("--events", default=50, type=int, help="user events sent by each client")
+    parser.add_argument("--timeout", default=2.0, type=float, help="seconds to wait for a state change")
+    parser.add_argument("--executor", default="inline", help="inline or thread:N")
+    parser.add_argument("--encoding", default="json", choices=["json", "msgpack"])
+    parser.add_argument("--compression-level", default=0, type=int)
+    parser.add_argument("--output", default="bench_server.json")
+    args = parser.parse_args()
+    random.seed(0)
+
+    config = argparse.Namespace(apps=args.apps, top_bar=0, debug=False, executor=executor_type(args.executor),
+                                encoding=args.encoding, compression_level=args.compression_level)
+    sock, port = tornado.testing.bind_unused_port()
+    server = tornado.httpserver.HTTPServer(make_app(config))
+    server.add_sockets([sock])
+
+    async def run():
+        return [await bench_app(port, app, args) for app in sorted(glob.glob(args.apps))]
+    results = tornado.ioloop.IOLoop.current().run_sync(run)
+
+    for result in results:
+        print("{app}: open {open_latency_ms[p50]:.1f} ms, round trip {rt} ms, "
+              "{messages_per_s:.0f} messages/s, {rss_per_session_mb:.2f} MB/session, "
+              "{timeouts}/{events} timeouts".format(
+                  rt="{:.1f}".format(result["roundtrip_ms"]["p50"]) if result["roundtrip_ms"] else "-",
+                  **result))
+    with open(args.output, "w") as file:
+        json.dump({"time": time.time(), "python": platform.python_version(),
+                   "tornado": tornado.version, "options": vars(args), "results": results}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
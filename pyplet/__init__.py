@@ -1 +1,10 @@
-root = None
+import contextvars
+
+_root = contextvars.ContextVar("pyplet_root", default=None)
+
+
+def __getattr__(name):
+    # root is the Feed of the session running in the current context
+    if name == "root":
+        return _root.get()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
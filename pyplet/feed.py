@@ -1,61 +1,342 @@
-from .primitives import Component, JSClass
+from .primitives import Blob, Component, JSClass
+from .widgets import Image
 from .transpiler import js_code
 from .js_lib import jQ
 
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib._pylab_helpers import Gcf
 from matplotlib import pyplot as plt
 
 import numpy as np
 import imageio
 
+import concurrent.futures
 import collections
 import contextlib
-import base64
+import contextvars
+import threading
+import weakref
+import datetime
+import hashlib
+import time
 import sys
 import io
+import os
 
 import matplotlib
 matplotlib.use("Agg")
 
 
-def arrays_to_rgba(r=None, g=None, b=None, alpha=None, scale=1):
-    f = [x for x in (r, g, b) if x is not None][0]
-    if r is None: r = np.zeros_like(f)
-    if g is None: g = np.zeros_like(f)
-    if b is None: b = np.zeros_like(f)
-    if alpha is None:
-        alpha = 255
-    if isinstance(alpha, (float, int)):
-        alpha = np.ones_like(f) * alpha
+def _convert_into(out, image, scale=1):
+    """Writes image*scale into the uint8 array out, clipped to [0, 255].
+    Non uint8 images go through a small float scratch buffer, row chunk by row
+    chunk, instead of full-size temporaries."""
+    if image.dtype == np.uint8 and scale == 1:
+        _copy_channels(out, image)
+        return
+    if out.size == 0:
+        return
+    rows = max(1, 65536 // max(1, out[0].size))
+    scratch = np.empty((min(rows, len(out)), *out.shape[1:]),
+                       np.result_type(image.dtype, np.float32))
+    for start in range(0, len(out), rows):
+        chunk = scratch[:len(out)-start] if start+rows > len(out) else scratch
+        np.multiply(image[start:start+rows], scale, out=chunk, casting="unsafe")
+        np.clip(chunk, 0, 255, out=chunk)
+        _copy_channels(out[start:start+rows], chunk)
+
+
+def _copy_channels(out, image):
+    # Into some channels of HWC pixels, channel by channel: numpy then loops
+    # along rows of pixels instead of along the few channels of each pixel
+    if out.ndim == 3 and not out.flags.c_contiguous:
+        for c in range(out.shape[-1]):
+            np.copyto(out[..., c], image[..., c], casting="unsafe")
     else:
-        alpha = alpha * scale
-    return np.stack((r*scale, g*scale, b*scale, alpha), axis=-1).astype(np.uint8)
+        np.copyto(out, image, casting="unsafe")
+
+
+_buffers = threading.local()
+
+
+def _buffer(shape):
+    """Output buffer reused by the calls of the current thread"""
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None or buffer.shape != shape:
+        buffer = _buffers.buffer = np.empty(shape, np.uint8)
+    return buffer
+
+
+def arrays_to_rgba(r=None, g=None, b=None, alpha=None, scale=1, out=None):
+    f = [x for x in (r, g, b) if x is not None][0]
+    if out is None:
+        out = np.empty((*np.shape(f), 4), np.uint8)
+    for i, channel in enumerate((r, g, b)):
+        if channel is None:
+            out[..., i] = 0
+        else:
+            _convert_into(out[..., i], np.asarray(channel), scale)
+    if out.shape[-1] == 4:
+        if alpha is None:
+            alpha = 255
+        if isinstance(alpha, (float, int)):
+            out[..., 3] = alpha
+        else:
+            _convert_into(out[..., 3], np.asarray(alpha), scale)
+    return out
 
 
-def img_to_rgba(image, scale=1, CHW=False):
+def img_to_rgba(image, scale=1, CHW=False, out=None, alpha=True):
+    """Converts HW, HWC or CHW (if CHW) images with 1 to 4 channels to uint8
+    RGBA, or RGB if not alpha. The result is written into out if given."""
+    image = np.asarray(image)
     if len(image.shape) == 2:
         image = image[...,None]
     elif CHW:
         image = np.moveaxis(image, 0, 2)
-    if scale != 1:
-        image = image*scale
-    if image.dtype != np.uint8:
-        image = image.astype(np.uint8)
     assert len(image.shape) == 3
-    if image.shape[-1] == 1:
-        image = np.tile(image, [1, 1, 3])
-    if image.shape[-1] == 2:
-        image = np.concatenate((image,
-                                np.zeros([*image.shape[:2], 1], dtype=np.uint8)),
-                               axis=-1)
-    if image.shape[-1] == 3:
-        image = np.concatenate((image, 255*np.ones(image.shape[:-1], dtype=np.uint8)[...,None]), axis=-1)
-    assert image.shape[-1] == 4
+    h, w, channels = image.shape
+    assert 1 <= channels <= 4
+    if out is None:
+        out = np.empty((h, w, 4 if alpha else 3), np.uint8)
+    assert out.shape == (h, w, 4 if alpha else 3)
+    if image.shape == out.shape and image.flags.c_contiguous:
+        # Same layout, converted as one contiguous block
+        _convert_into(out, image, scale)
+    elif channels == 1:
+        # Converted once, then copied by bands of rows, numpy copying each
+        # of them through a temporary as they share memory
+        _convert_into(out[..., 0], image[..., 0], scale)
+        rows = max(1, 65536 // max(1, w))
+        for start in range(0, h, rows):
+            band = out[start:start+rows]
+            band[..., 1] = band[..., 2] = band[..., 0]
+    elif image.strides[2] <= image.strides[1]:
+        used = min(channels, out.shape[-1])
+        _convert_into(out[..., :used], image[..., :used], scale)
+    else:
+        # Planes of CHW images are converted one by one
+        for c in range(min(channels, out.shape[-1])):
+            _convert_into(out[..., c], image[..., c], scale)
+    if channels == 2:
+        out[..., 2] = 0
+    if alpha and channels < 4:
+        out[..., 3] = 255
+    return out
+
+
+# codec: (imageio format, mime, imageio option for the level, default level)
+_codecs = {
+    "jpeg": ("jpg", "image/jpeg", "quality", 100),
+    "png": ("png", "image/png", "compress_level", 6),
+    "webp": ("webp", "image/webp", "quality", 90),
+}
+
+
+def _webp_available():
+    try:
+        from PIL import features
+        return features.check("webp")
+    except ImportError:
+        return False
+
+
+def parse_codec(codec):
+    """"jpeg", "png" or "webp", optionally followed by ":level", the quality
+    for jpeg/webp or the compression level for png. Without WebP support,
+    webp falls back to jpeg with the same quality."""
+    name, _, level = codec.partition(":")
+    assert name in _codecs, "unknown codec {!r}".format(codec)
+    if name == "webp" and not _webp_available():
+        name = "jpeg"
+    return name, int(level) if level else _codecs[name][3]
+
+
+def encode_image(rgba, codec="jpeg"):
+    name, level = parse_codec(codec)
+    format, mime, option, _ = _codecs[name]
+    if name == "jpeg":
+        rgba = rgba[..., :3]
+    file = io.BytesIO()
+    imageio.imsave(file, rgba, format=format, **{option: level})
+    return Blob(file.getvalue(), mime)
+
+
+class _EncodeCache:
+    """Encoded images by content, up to maxbytes of encoded data, least
+    recently used are dropped first"""
+
+    def __init__(self, maxbytes=2**25):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(image, *params):
+        image = np.asarray(image)
+        data = image.data if image.flags.c_contiguous else image.tobytes()
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        return (digest, image.shape, image.dtype.str, *params)
+
+    def get(self, key):
+        with self._lock:
+            blob = self._items.get(key)
+            if blob is not None:
+                self._items.move_to_end(key)
+            return blob
+
+    def put(self, key, blob):
+        if len(blob.data) > self.maxbytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.nbytes -= len(previous.data)
+            self._items[key] = blob
+            self.nbytes += len(blob.data)
+            while self.nbytes > self.maxbytes:
+                _, dropped = self._items.popitem(last=False)
+                self.nbytes -= len(dropped.data)
+
+
+_encode_cache = _EncodeCache()
+
+
+def encode_image_cached(image, scale=1, CHW=False, codec="jpeg"):
+    key = _encode_cache.key(image, scale, CHW, codec)
+    blob = _encode_cache.get(key)
+    if blob is None:
+        image = np.asarray(image)
+        alpha = parse_codec(codec)[0] != "jpeg"
+        h, w = image.shape[1:] if CHW and image.ndim == 3 else image.shape[:2]
+        rgba = img_to_rgba(image, scale=scale, CHW=CHW, alpha=alpha,
+                           out=_buffer((h, w, 4 if alpha else 3)))
+        blob = encode_image(rgba, codec)
+        _encode_cache.put(key, blob)
+    return blob
+
+
+_render_pool = concurrent.futures.ThreadPoolExecutor(os.cpu_count() or 1,
+                                                     thread_name_prefix="pyplet-render")
+
+
+def render_figure(figure, codec="jpeg"):
+    """Renders a figure with the object-oriented Agg API, which does not touch
+    the pyplot global state and can thus run on another thread. Figures are
+    seldom rendered twice the same, and are kept out of the encode cache."""
+    canvas = FigureCanvasAgg(figure)
+    figure.tight_layout()
+    canvas.draw()
+    return encode_image(np.asarray(canvas.buffer_rgba()), codec)
+
+
+_current_block = contextvars.ContextVar("pyplet_block", default=None)
+_plt_show = plt.show
+
+
+class _BlockDispatch:
+    """Stands for sys.stdout/sys.stderr in the whole process, and writes into
+    the Block entered in the current context, so that sessions can run
+    concurrently"""
+
+    def __init__(self, stream, fallback):
+        self.stream = stream
+        self.fallback = fallback
+
+    def _target(self):
+        block = _current_block.get()
+        return self.fallback if block is None else block._streams[self.stream]
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+class _SessionFigures:
+    """Stands for the figures of pyplot (Gcf.figs) in the whole process. Each
+    session gets its own, so that sessions running concurrently on the
+    executor threads do not share the current figure."""
+
+    def __init__(self, figures):
+        self._default = figures
+        self._sessions = weakref.WeakKeyDictionary()
+
+    def _figures(self):
+        block = _current_block.get()
+        if block is None:
+            return self._default
+        figures = self._sessions.get(block._session)
+        if figures is None:
+            figures = self._sessions[block._session] = collections.OrderedDict()
+        return figures
 
-    return image
+    def __getattr__(self, name):
+        return getattr(self._figures(), name)
+
+    def __getitem__(self, num):
+        return self._figures()[num]
+
+    def __setitem__(self, num, manager):
+        self._figures()[num] = manager
+
+    def __delitem__(self, num):
+        del self._figures()[num]
+
+    def __contains__(self, num):
+        return num in self._figures()
+
+    def __iter__(self):
+        return iter(self._figures())
+
+    def __len__(self):
+        return len(self._figures())
+
+
+def _show(*args, **kwargs):
+    block = _current_block.get()
+    if block is None:
+        return _plt_show(*args, **kwargs)
+    return block._show(*args, **kwargs)
+
+
+def _install_dispatch():
+    if not isinstance(sys.stdout, _BlockDispatch):
+        sys.stdout = _BlockDispatch("stdout", sys.stdout)
+    if not isinstance(sys.stderr, _BlockDispatch):
+        sys.stderr = _BlockDispatch("stderr", sys.stderr)
+    plt.show = _show
+    if not isinstance(Gcf.figs, _SessionFigures):
+        Gcf.figs = _SessionFigures(Gcf.figs)
+
+
+def _collapse_carriage_returns(text):
+    """Keeps what follows the last carriage return of each line. The first line
+    keeps it, so that the view still overwrites the line it already shows."""
+    first, *rest = text.replace("\r\n", "\n").split("\n")
+    if "\r" in first:
+        first = first[first.rindex("\r"):]
+    rest = [line[line.rindex("\r")+1:] if "\r" in line else line for line in rest]
+    return "\n".join([first, *rest])
 
 
 class Block(Component):
-    def init(self, classes="", style="", ms=1000):
+    """Content printed or appended while the block is entered. With
+    max_entries or max_bytes, the oldest content is dropped, down to 90% of
+    the limit, both here and in the frontend."""
+
+    def init(self, classes="", style="", ms=1000, flush_ms=50, codec="jpeg", max_entries=None, max_bytes=None):
+        self._codec = codec
+        self._max_entries = int(max_entries) if max_entries else None
+        self._max_bytes = int(max_bytes) if max_bytes else None
+        self._sizes = []                               # Of the entries, if limited
+        self._bytes = 0
+        self._streams = {
+            "stdout": Block._StreamCapture(self, stream="stdout", ms=int(flush_ms)),
+            "stderr": Block._StreamCapture(self, stream="stderr", ms=int(flush_ms)),
+        }
         self.classes = classes
         self.style = style
         self.ms = int(ms)
@@ -63,80 +344,185 @@ class Block(Component):
 
     @contextlib.contextmanager
     def enter(self):
-        _stdout = sys.stdout
-        _stderr = sys.stderr
-        _show = plt.show
+        _install_dispatch()
+        token = _current_block.set(self)
         try:
-            sys.stdout = Block._StreamCapture(self, stream="stdout")
-            sys.stderr = Block._StreamCapture(self, stream="stderr")
-            plt.show = self._show
             yield self
         except Exception as e:
             import traceback
             traceback.print_exc()
         finally:
-            plt.show = _show
-            sys.stdout = _stdout
-            sys.stderr = _stderr
+            _current_block.reset(token)
+
+    def _flush_streams(self, but=None):
+        for capture in self._streams.values():
+            if capture is not but:
+                capture.flush()
 
     def clear(self):
+        for capture in self._streams.values():
+            capture.discard()
         self.content = []
+        self._sizes.clear()
+        self._bytes = 0
+
+    def _add(self, entry):
+        self.content__append = entry
+        if self._max_entries or self._max_bytes:
+            self._sizes.append(_entry_size(entry))
+            self._bytes += self._sizes[-1]
+            self._evict()
+
+    def _resize(self, entry):
+        # Images are filled after being appended
+        if not self._max_bytes:
+            return
+        content = self._state["content"]
+        for i in range(len(content) - 1, -1, -1):
+            if content[i] is entry:
+                size = _entry_size(entry)
+                self._bytes += size - self._sizes[i]
+                self._sizes[i] = size
+                self._evict()
+                return
+
+    def _evict(self):
+        # Down to 90% of the limits, so that evictions are batched, but the
+        # newest entry is always kept
+        n, count = len(self._sizes), 0
+        if self._max_entries and n > self._max_entries:
+            count = n - max(1, self._max_entries * 9 // 10)
+        if self._max_bytes and self._bytes > self._max_bytes:
+            left = self._bytes - sum(self._sizes[:count])
+            while count < n - 1 and left > self._max_bytes * 9 // 10:
+                left -= self._sizes[count]
+                count += 1
+        if count:
+            self._bytes -= sum(self._sizes[:count])
+            del self._sizes[:count]
+            self.content__drop = count
 
     def append(self, widget):
+        self._flush_streams()
         if isinstance(widget, Component):
-            self.content__append = widget
+            self._add(widget)
         elif isinstance(widget, str):
-            self.content__append = {"html": widget}
-
-    def image(self, image, scale=1, CHW=False, style="", end="", img=None):
-        file = io.BytesIO()
-        imageio.imsave(file, img_to_rgba(image, scale=scale, CHW=CHW), format="jpg", quality=100)
-        src = "data:image/jpg;base64,{}".format(
-            base64.b64encode(file.getvalue()).decode("utf-8"))
+            self._add({"html": widget})
+        elif isinstance(widget, Blob):
+            self.append(Image(src=widget))
 
+    def _send_image(self, src, style="", end="", img=None):
         if img is not None:
             assert not end and not style
-            img.src = src
+            # Cached encodings are the same Blob, that the frontend already has
+            if img.src is not src:
+                img.src = src
+                self._resize(img)
         else:
-            self.append('<img src={!r} style={!r} />{}'.format(src, style, end))
-
-    def _show(self, style="", end="", img=None):
-        file = io.BytesIO()
-        plt.tight_layout()
-        plt.savefig(file, dpi="figure", format="jpg", quality=100)
-        plt.close()
-        src = "data:image/jpg;base64,{}".format(
-            base64.b64encode(file.getvalue()).decode("utf-8"))
-
-        if img is not None:
+            self.append(Image(src=src, style=style))
+            if end:
+                self.append(end)
+
+    def image(self, image, scale=1, CHW=False, style="", end="", img=None, codec=None):
+        """codec defaults to the one of the Block, see parse_codec.
+        img may be an Image, or a component taking arrays through set_image
+        such as TiledImage or LiveImage."""
+        if img is not None and hasattr(img, "set_image"):
             assert not end and not style
-            img.src = src
+            img.set_image(image, scale=scale, CHW=CHW)
+            return
+        codec = self._codec if codec is None else codec
+        self._send_image(encode_image_cached(image, scale, CHW, codec), style, end, img)
+
+    def _show(self, style="", end="", img=None, codec=None):
+        """plt.show() replacement: the figure leaves pyplot and is rendered on
+        the render pool, its Image is filled once it is ready"""
+        figure = plt.gcf()
+        plt.close(figure)
+        if img is None:
+            img = Image(style=style)
+            self.append(img)
+            if end:
+                self.append(end)
         else:
-            self.append('<img src={!r} style={!r} />{}'.format(src, style, end))
+            assert not end and not style
+        future = _render_pool.submit(render_figure, figure,
+                                     self._codec if codec is None else codec)
+        session = self._session
+        future.add_done_callback(lambda future: session._loop.add_callback(
+            session.submit, self._show_rendered, img, future))
+        return future
+
+    def _show_rendered(self, img, future):
+        try:
+            self._send_image(future.result(), img=img)
+        except:
+            import traceback
+            traceback.print_exc()
 
     def remove(self, widget):
+        self._flush_streams()
+        if self._max_entries or self._max_bytes:
+            self._bytes -= self._sizes.pop(self._state["content"].index(widget))
         self.content__remove = widget
 
     class _StreamCapture:
-        def __init__(self, block, stream):
+        """Buffers what is written, and sends it as soon as a line is complete
+        but at most once every ms milliseconds"""
+
+        def __init__(self, block, stream, ms=50):
             self.block = block
             self.stream = stream
+            self.ms = ms
+            self._buffer = []
+            self._last_flush = 0
+            self._scheduled = False
+
+        def isatty(self):
+            return False
 
         def write(self, text):
-            self.block.content__append = dict(content=text, stream=self.stream)
+            if not text: return 0
+            # Keep the order of what is printed on the different streams
+            self.block._flush_streams(but=self)
+            self._buffer.append(text)
+            if "\n" in text and time.monotonic() - self._last_flush >= self.ms / 1000:
+                self.flush()
+            elif not self._scheduled:
+                self._scheduled = True
+                self.block._session.add_timeout(datetime.timedelta(milliseconds=self.ms),
+                                                self._timeout)
+            return len(text)
+
+        def _timeout(self):
+            self._scheduled = False
+            self.block._session.submit(self.flush)
+
+        def flush(self):
+            if not self._buffer: return
+            text = _collapse_carriage_returns("".join(self._buffer))
+            self._buffer.clear()
+            self._last_flush = time.monotonic()
+            self.block._add(dict(content=text, stream=self.stream))
+
+        def discard(self):
+            self._buffer.clear()
 
     __view__ = JSClass('''
     class BlockView {
         constructor() {
             this.domNode = document.createElement("div")
             this.jq = $(this.domNode)
+            // DOM nodes of each content entry, dropped with the entry
+            this.nodes = []
         }
 
         append(content) {
+            let nodes = []
             if (content.stream) {
                 let block = this.domNode
                 let last = block.lastChild
-                if ((!last || !last.classList.contains(content.stream))) {
+                if ((!last || !last.classList || !last.classList.contains(content.stream))) {
                     last = document.createElement("pre")
                     last.classList.add(content.stream)
                     last.style.color = content.color
@@ -145,25 +531,63 @@ class Block(Component):
                 let newContent = content.content
                 let lastCharet = newContent.lastIndexOf("\\r")
                 if (lastCharet >= 0) {
-                    whole = last.innerText + content.content.slice(0, lastCharet)
-                    lastLine = last.innerText.lastIndexOf("\\n")
-                    last.innerText = whole.slice(0,lastLine+1) + newContent.slice(lastCharet+1)
-                } else {
-                    last.innerText += content.content
+                    this.drop_last_line(last)
+                    newContent = newContent.slice(lastCharet+1)
                 }
+                // Each entry is a span of the pre, to be evicted on its own
+                let span = document.createElement("span")
+                span.textContent = newContent
+                last.appendChild(span)
+                nodes.push(span)
             }
             if (content.html) {
+                let count = this.domNode.childNodes.length
                 this.jq.append(content.html)
+                nodes.push(...Array.from(this.domNode.childNodes).slice(count))
             }
             if (content.comp_id) {
                 let comp = g.session.components[content.comp_id]
                 this.domNode.appendChild(comp.domNode)
+                nodes.push(comp.domNode)
+            }
+            this.nodes.push(nodes)
+        }
+
+        drop_last_line(pre) {
+            // What follows a carriage return replaces the last line
+            for (let span = pre.lastChild; span; span = pre.lastChild) {
+                let text = span.textContent
+                let lastLine = text.lastIndexOf("\\n")
+                if (lastLine >= 0) {
+                    span.textContent = text.slice(0, lastLine+1)
+                    return
+                }
+                span.remove()
+            }
+        }
+
+        evict(count) {
+            for (let nodes of this.nodes.splice(0, count)) {
+                for (let node of nodes) {
+                    let parent = node.parentNode
+                    if (parent && parent !== this.domNode && parent.parentNode === this.domNode) {
+                        // Span of a stream
+                        node.remove()
+                        if (!parent.firstChild) {
+                            parent.remove()
+                        }
+                    } else if (parent === this.domNode) {
+                        // Components may have been moved to another block since
+                        node.remove()
+                    }
+                }
             }
         }
 
         handle_height() {
             let height = this.jq.height()
             this.domNode.innerHTML = ""
+            this.nodes = []
             if (this._clearPending) {
                 clearTimeout(this._clearPending[1])
                 height = Math.max(height, this._clearPending[0])
@@ -177,6 +601,37 @@ class Block(Component):
             this._clearPending = [height, setTimeout(clearHeight.bind(this), this.ms)]
         }
 
+        state_patch(key, ops) {
+            // this.content is already patched, the DOM follows as long as
+            // entries are only dropped at the head and added at the tail
+            if (key !== "content") {
+                return false
+            }
+            let length = this.nodes.length
+            for (let [op, path, arg] of ops) {
+                if (op === "delete" && path.length === 1 && path[0] === 0 && arg <= length) {
+                    length -= arg
+                } else if (op === "insert" && path.length === 1 && path[0] === length) {
+                    length += arg.length
+                } else {
+                    return false
+                }
+            }
+            if (length !== this.content.length) {
+                return false
+            }
+            for (let [op, path, arg] of ops) {
+                if (op === "delete") {
+                    this.evict(arg)
+                } else {
+                    for (let c of arg) {
+                        this.append(c)
+                    }
+                }
+            }
+            return true
+        }
+
         state_change(state_change) {
             if (state_change.content !== undefined) {
                 this.handle_height()
@@ -185,10 +640,18 @@ class Block(Component):
                 }
             }
             if (state_change.content__append !== undefined) {
+                // Kept in sync for the patches computed against it
+                this.content.push(state_change.content__append)
                 this.append(state_change.content__append)
             }
+            if (state_change.content__drop !== undefined) {
+                this.content.splice(0, state_change.content__drop)
+                this.evict(state_change.content__drop)
+            }
             if (state_change.content__remove !== undefined) {
-                this.domNode.removeChild(g.session.components[state_change.content__remove.comp_id].domNode)
+                let comp_id = state_change.content__remove.comp_id
+                this.content.splice(this.content.findIndex((c) => c.comp_id === comp_id), 1)
+                this.domNode.removeChild(g.session.components[comp_id].domNode)
                 this.handle_height()
             }
             if (state_change.classes !== undefined) {
@@ -202,6 +665,14 @@ class Block(Component):
     ''')
 
 
+def _entry_size(entry):
+    """Bytes of text or image held by a content entry"""
+    if isinstance(entry, dict):
+        return len(entry.get("content") or entry.get("html") or "")
+    src = getattr(entry, "src", None)
+    return len(src.data) if isinstance(src, Blob) else 0
+
+
 def _trim(strings):
     return [string.strip() for string in strings]
 
@@ -253,9 +724,9 @@ class Feed(Component):
         blk = self._getblk(name)
         blk.append(widget)
 
-    def image(self, image, scale=1, CHW=False, style="", end=""):
+    def image(self, image, scale=1, CHW=False, style="", end="", codec=None):
         blk = self._getblk(None)
-        blk.image(image, scale, CHW, style, end)
+        blk.image(image, scale, CHW, style, end, codec=codec)
 
     def remove(self, widget, name=None):
         blk = self._getblk(name)
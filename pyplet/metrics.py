@@ -0,0 +1,125 @@
+"""Instrumentation of the server process, exposed on /metrics in the
+Prometheus text format."""
+import threading
+import bisect
+import time
+
+
+_registry = []
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        # Metrics without labels are exposed before their first change
+        self._values = {} if labels else {(): self._zero()}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _zero(self):
+        return 0
+
+    def _series(self, values, suffix="", extra=()):
+        labels = ",".join('{}="{}"'.format(name, _escape(value))
+                          for name, value in list(zip(self.labels, values)) + list(extra))
+        return "{}{}{}".format(self.name, suffix, "{" + labels + "}" if labels else "")
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.help),
+                 "# TYPE {} {}".format(self.name, self.kind)]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.extend(self._render(labels, value))
+        return lines
+
+    def _render(self, labels, value):
+        return ["{} {}".format(self._series(labels), _number(value))]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+    buckets = (.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5)
+
+    def _zero(self):
+        # Per bucket counts (the last one being +Inf), then the sum
+        return [0] * (len(self.buckets) + 1) + [0.0]
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = self._zero()
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def _render(self, labels, counts):
+        lines, total = [], 0
+        for bound, count in zip(self.buckets + ("+Inf",), counts):
+            total += count
+            lines.append("{} {}".format(self._series(labels, "_bucket", [("le", bound)]), total))
+        lines.append("{} {}".format(self._series(labels, "_sum"), _number(counts[-1])))
+        lines.append("{} {}".format(self._series(labels, "_count"), total))
+        return lines
+
+
+class timer:
+    """Observes the time spent in a with block"""
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, *labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render():
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+sessions = Gauge("pyplet_sessions", "Open sessions")
+components = Gauge("pyplet_components", "Live components")
+messages = Counter("pyplet_messages_total", "Messages sent to clients", ["type"])
+message_bytes = Counter("pyplet_message_bytes_total", "Encoded size of the messages sent to clients", ["type"])
+component_bytes = Counter("pyplet_component_bytes_total", "State changes and blobs sent, per component class",
+                          ["component"])
+raw_bytes = Counter("pyplet_raw_bytes_total", "Bytes written on the websockets, before compression")
+wire_bytes = Counter("pyplet_wire_bytes_total", "Bytes written on the websockets, after compression")
+conflated = Counter("pyplet_conflated_total", "Messages replaced by newer ones while a client was backed up")
+dropped = Counter("pyplet_dropped_total", "Messages discarded with the clients that could not keep up")
+encode_seconds = Histogram("pyplet_encode_seconds", "Time serializing messages")
+listener_seconds = Histogram("pyplet_listener_seconds", "Time in on_change listeners", ["listener"])
+user_event_seconds = Histogram("pyplet_user_event_seconds", "Time handling user events, per component class",
+                               ["component"])
@@ -1,14 +1,19 @@
 import tornado.websocket
+import tornado.ioloop
 
 from .transpiler import js_code
 from .js_lib import undefined
+from . import metrics
 
 import collections
 import contextlib
+import contextvars
 import functools
+import itertools
 import threading
 import textwrap
 import weakref
+import struct
 import json
 import re
 
@@ -23,10 +28,90 @@ def update_state(local_state, compact_state_change):
                 local_state[k].append(v)
             if action == 'remove':
                 local_state[k].remove(v)
+            if action == 'drop':
+                # The first v items
+                del local_state[k][:v]
         else:
             local_state[k] = compact_state_change[k]
 
 
+class Blob:
+    """Binary value, sent raw in its own frame and seen by views as an object URL"""
+
+    def __init__(self, data, mime):
+        self.data = data
+        self.mime = mime
+
+
+def snapshot(value):
+    """Copy of a list/dict value as the frontend sees it"""
+    if isinstance(value, (list, tuple)):
+        return [snapshot(v) for v in value]
+    if isinstance(value, dict):
+        return {k: snapshot(v) for k, v in value.items()}
+    if isinstance(value, Component):
+        return {"comp_id": value._id}
+    return value
+
+
+def compute_patch(old, new, path=()):
+    """Operations turning the snapshot old into the snapshot new, as
+    [op, path, arg] where op is "replace" (arg is the value), "delete" (arg is
+    the number of list items, or None for a dict key) or "insert" (arg is the
+    list of inserted items)"""
+    ops = []
+    if isinstance(old, dict):
+        for k in old:
+            if k not in new:
+                ops.append(["delete", [*path, k], None])
+        for k, v in new.items():
+            if k not in old:
+                ops.append(["replace", [*path, k], v])
+            elif old[k] != v:
+                ops.extend(_compute_item_patch(old[k], v, [*path, k]))
+        return ops
+    shift = _window_shift(old, new)
+    if shift:
+        # Sliding window, items dropped at the head and added at the tail
+        return [["delete", [*path, 0], shift], *compute_patch(old[shift:], new, path)]
+    n = min(len(old), len(new))
+    start = 0
+    while start < n and old[start] == new[start]:
+        start += 1
+    suffix = 0
+    while suffix < n - start and old[-1-suffix] == new[-1-suffix]:
+        suffix += 1
+    old_end, new_end = len(old) - suffix, len(new) - suffix
+    if old_end == new_end:
+        for i in range(start, new_end):
+            ops.extend(_compute_item_patch(old[i], new[i], [*path, i]))
+        return ops
+    if old_end > start:
+        ops.append(["delete", [*path, start], old_end - start])
+    if new_end > start:
+        ops.append(["insert", [*path, start], new[start:new_end]])
+    return ops
+
+
+def _window_shift(old, new):
+    """Number of items to drop from the head of old for its remaining items to
+    start new, unless new starts with old"""
+    if not old or not new or new[:len(old)] == old:
+        return 0
+    for shift in range(1, len(old)):
+        if old[shift] == new[0] and old[shift:] == new[:len(old)-shift]:
+            return shift
+    return 0
+
+
+def _compute_item_patch(old, new, path):
+    if old == new:
+        return []
+    if type(old) is type(new) and isinstance(new, (list, dict)):
+        return compute_patch(old, new, path)
+    return [["replace", path, new]]
+
+
 def compute_events(compact_state_change):
     events = set()
     for k, v in compact_state_change.items():
@@ -43,31 +128,39 @@ class Component:
 
     Their state is meant to characterize them fully, but nothing constraints to it.
     """
+    # Subclasses still get a __dict__ for their own attributes
+    __slots__ = ("_state", "_id", "_session", "_listeners", "_batch", "_batch_events", "_sent",
+                 "__weakref__")
+    _profiled = True                                   # Callbacks measured by the session profiler
 
     def __init__(self, **kwargs):
         self._state = {}                               # Internal state
-        self._id = id(self)                            # Unique ID
-        self._session = Session._current               # Session
+        self._session = Session.current()              # Session
+        self._id = next(self._session._ids)            # Unique ID within the session
         self._session._components[self._id] = self
-        self._listeners = []
+        metrics.components.inc()
+        self._listeners = ()                           # Replaced on change, never mutated
         self._batch = None
+        self._batch_events = None
+        self._sent = None                              # Last list/dict values sent, if any
         # Whether the widget is initialized (to skip validation on init)
         # Update Frontend
         view_ref = self.__view__.ref
         if view_ref not in self._session._views:
             self._session._views[view_ref] = self.__view__
-            msg = {
-                "type": "class",
-                "clss": view_ref,
-                "defn": self.__view__.defn
-            }
-            self._session.write_message(json.dumps(msg))
+            if view_ref not in self._session.bundled:
+                msg = {
+                    "type": "class",
+                    "clss": view_ref,
+                    "defn": self.__view__.defn
+                }
+                self._session.write_message(self._session.encode(msg))
         msg = {
             "type": "new",
             "comp_id": self._id,
             "clss": view_ref
         }
-        self._session.write_message(json.dumps(msg))
+        self._session.write_message(self._session.encode(msg))
         with self.batch():
             self.init(**kwargs)
 
@@ -81,28 +174,76 @@ class Component:
         self._state.update(state_change)
 
     def _send_frontend(self, state_change):
-        if not state_change: return
+        blobs = {k: v for k, v in state_change.items() if isinstance(v, Blob)}
+        if blobs:
+            state_change = {k: v for k, v in state_change.items() if k not in blobs}
+            for k, blob in blobs.items():
+                metrics.component_bytes.inc(type(self).__name__, amount=len(blob.data))
+                self._session.write_binary({"comp_id": self._id, "field": k, "mime": blob.mime}, blob.data,
+                                           conflate=("blob", self._id, k))
+        state_change, state_patch = self._diff_sent(state_change)
+        if not state_change and not state_patch: return
         msg = {
             "type": "state_change",
             "comp_id": self._id,
             "state_change": state_change,
         }
-        # state_change may contain components => special encoder
-        self._session.write_message(JSONEncoder().encode(msg))
+        if state_patch:
+            msg["state_patch"] = state_patch
+        if state_patch or any('__' in k for k in state_change):
+            # Patches and actions apply to the values sent before, that must
+            # not be replaced anymore
+            conflate = ("pin", self._id, frozenset(k.split('__')[0] for k in [*state_change, *state_patch]))
+        else:
+            # Only full values may replace the previous ones
+            conflate = ("state", self._id, frozenset(state_change))
+        data = self._session.encode(msg)
+        metrics.component_bytes.inc(type(self).__name__, amount=len(data))
+        self._session.write_message(data, conflate=conflate)
+
+    def _diff_sent(self, state_change):
+        """Splits state_change between full values and patches of the list/dict
+        values the frontend already has"""
+        full, patches = {}, {}
+        sent = self._sent or {}
+        for k, v in state_change.items():
+            if '__' in k:
+                full[k] = v
+                if k.split('__')[0] in sent:
+                    update_state(sent, {k: snapshot(v)})
+            elif isinstance(v, (list, tuple, dict)):
+                new = snapshot(v)
+                old = sent.get(k)
+                sent[k] = new
+                if type(old) is not type(new):
+                    full[k] = v
+                    continue
+                ops = compute_patch(old, new)
+                if len(ops) * 2 > len(new) + 1:
+                    full[k] = v
+                elif ops:
+                    patches[k] = ops
+            else:
+                sent.pop(k, None)
+                full[k] = v
+        self._sent = sent or None
+        return full, patches
 
     def _trigger_listeners(self, state_change):
+        profiler = self._session.profiler if self._profiled else None
         for listener in self._listeners:
-            listener(state_change)
+            name = _callback_name(listener)
+            with metrics.timer(metrics.listener_seconds, name):
+                if profiler is None:
+                    listener(state_change)
+                else:
+                    fields = ",".join(sorted(state_change))
+                    profiler.run((type(self).__name__, fields, name), listener, state_change)
 
     def on_change(self, callback, events=None, trigger=True):
         if events is not None:
-            if isinstance(events, str):
-                events = [events]
-            _callback = callback
-            def callback(state_change):
-                if any(e in state_change for e in events):
-                    _callback(state_change)
-        self._listeners.append(callback)
+            callback = _Filtered(callback, (events,) if isinstance(events, str) else tuple(events))
+        self._listeners += (callback,)
         if trigger:
             callback(set(self._state))
 
@@ -112,42 +253,84 @@ class Component:
         compact_state_change = dict(args, **kwargs) if args and kwargs else kwargs or dict(args)
         if not compact_state_change:
             return
+        if self._batch is None and self._session._transaction is not None:
+            self._session._join(self)
         if self._batch is not None:
-            assert not any('__' in k for k in compact_state_change), """
-                Actions are currently not supported in batched updates
-            """
             update_state(self._state, compact_state_change)
-            self._batch.update(compact_state_change)
+            if _trigger_listeners:
+                self._batch_events.update(compute_events(compact_state_change))
+            for k in compact_state_change:
+                # Actions are sent as a patch of the full value
+                k = k.split('__')[0]
+                if _send_frontend:
+                    self._batch[k] = self._state[k]
+                else:
+                    # The frontend has it already, e.g. from the user
+                    self._batch.pop(k, None)
         else:
             update_state(self._state, compact_state_change)
             self._notify(compact_state_change, _send_frontend, _trigger_listeners)
 
-    def _notify(self, compact_state_change, _send_frontend, _trigger_listeners):
+    def _notify(self, compact_state_change, _send_frontend, _trigger_listeners, events=None):
         # Update Frontend
         if _send_frontend:      self._send_frontend(compact_state_change)
         # Trigger listeners
-        if _trigger_listeners:  self._trigger_listeners(compute_events(compact_state_change))
+        if events is None:      events = compute_events(compact_state_change)
+        if _trigger_listeners and events:  self._trigger_listeners(events)
 
     @contextlib.contextmanager
     def batch(self, _send_frontend=True, _trigger_listeners=True):
         """Content should have very simple flow"""
+        if self._session._transaction is not None:
+            # Changes will be notified when the transaction ends
+            self._session._join(self)
+            if _send_frontend and _trigger_listeners:
+                yield
+                return
+            # Collected apart, to merge them with the flags of this batch
+            outer, outer_events = self._batch, self._batch_events
+            self._begin_batch()
+            try:
+                yield
+            finally:
+                batch, events = self._batch, self._batch_events
+                self._batch, self._batch_events = outer, outer_events
+            if _trigger_listeners:
+                outer_events.update(events)
+            for k, v in batch.items():
+                if _send_frontend:
+                    outer[k] = v
+                else:
+                    outer.pop(k, None)
+            return
         assert self._batch is None, """Recursive batching not supported"""
         try:
-            self._batch = {}
-            self._session._batching = True
+            self._begin_batch()
             yield
-            self._session._batching = False
-            self._notify(self._batch, _send_frontend, _trigger_listeners)
+            self._end_batch(_send_frontend, _trigger_listeners)
         finally:
             self._batch = None
+            self._batch_events = None
+
+    def _begin_batch(self):
+        self._batch = {}
+        self._batch_events = set()
+
+    def _end_batch(self, _send_frontend=True, _trigger_listeners=True):
+        batch, events = self._batch, self._batch_events
+        self._batch = self._batch_events = None
+        self._notify(batch, _send_frontend, _trigger_listeners, events)
 
     def __setattr__(self, name, value):
         if name.startswith("_"):
-            self.__dict__[name] = value
+            object.__setattr__(self, name, value)
         else:
             self.update((name,value))
     
     def __getattr__(self, name):
+        # Also reached by unset slots, and by hasattr() and getattr() defaults
+        if name == "_state" or name not in self._state:
+            raise AttributeError(name)
         return self._state[name]
 
     def __del__(self):
@@ -155,37 +338,275 @@ class Component:
             "type": "delete",
             "comp_id": self._id,
         }
-        self._session.write_message(json.dumps(msg))
+        self._session.write_message(self._session.encode(msg))
+        metrics.components.dec()
 
 
-class Session:
-    __lock = threading.RLock()
-    _current = None
+class _Filtered:
+    """Listener only called for some events"""
+    __slots__ = ("__wrapped__", "events")
+
+    def __init__(self, callback, events):
+        self.__wrapped__ = callback
+        self.events = events
 
-    def __init__(self, id, socket):
+    def __call__(self, state_change):
+        if any(e in state_change for e in self.events):
+            self.__wrapped__(state_change)
+
+
+def _callback_name(callback):
+    callback = getattr(callback, "__wrapped__", callback)
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+_current_session = contextvars.ContextVar("pyplet_session", default=None)
+
+
+class Session:
+    def __init__(self, id, socket, executor=None, high_water=2**20, max_pending=2**26):
         self.id = id
         self.closed = False
+        self.__lock = threading.RLock()
         self._socket = socket
+        self._executor = executor
+        self._tasks = collections.deque()
+        self._tasks_lock = threading.Lock()
         self._components = weakref.WeakValueDictionary()
+        self._ids = itertools.count(1)
+        self.packed = False                            # MessagePack instead of JSON
+        self.profiler = None
         self._views = weakref.WeakValueDictionary()
+        self.bundled = frozenset()                     # Views the page already defines
+        self._loop = tornado.ioloop.IOLoop.current()
+        # Outbound queue: [message, conflation key] entries, the message being
+        # None once replaced by a newer one while the socket is backed up
+        self._outbox = []
+        # Reentrant: a garbage collection while it is held may finalize a
+        # component of the session, whose __del__ writes a message
+        self._outbox_lock = threading.RLock()
+        self._conflatable = {}
+        self._pending = 0                              # Bytes in the outbox
+        self._in_flight = 0                            # Bytes written but not drained yet
+        self.high_water = high_water
+        self.max_pending = max_pending
+        self.conflated = 0
+        self.dropped = 0
+        self.raw_bytes = 0                             # Written on the socket, before compression
+        self.wire_bytes = 0                            # and after, as counted by the server
+        self._transaction = None                       # Components changed in the transaction
+        self._held = None                              # Messages held until the transaction ends
 
         self.__within = 0
         self.__wrappers = collections.OrderedDict()
         self.__entered = collections.OrderedDict()
 
+    @staticmethod
+    def current():
+        """Session entered in the current thread/context, if any"""
+        return _current_session.get()
+
+    def submit(self, f, *args):
+        """Runs f within the session, on the executor if there is one.
+        Tasks of a session are run one at a time, in submission order."""
+        if self._executor is None:
+            with self:
+                f(*args)
+            return
+        with self._tasks_lock:
+            self._tasks.append(functools.partial(f, *args))
+            if len(self._tasks) > 1: return
+        self._executor.submit(self._run_tasks)
+
+    def _run_tasks(self):
+        while True:
+            # The running task stays queued, so that submit does not start another worker
+            with self._tasks_lock:
+                task = self._tasks[0]
+            try:
+                with self:
+                    task()
+            except:
+                import traceback
+                traceback.print_exc()
+            with self._tasks_lock:
+                self._tasks.popleft()
+                if not self._tasks: return
+
+    def profile(self):
+        """Starts profiling the listeners and user events of the session"""
+        if self.profiler is None:
+            from .profiler import Profiler
+            self.profiler = Profiler()
+        return self.profiler
+
+    def add_timeout(self, delay, callback, *args):
+        """Thread-safe IOLoop.add_timeout, the callback runs on the IOLoop"""
+        self._loop.add_callback(self._loop.add_timeout, delay, callback, *args)
+
     def on_message(self, message):
-        message = json.loads(message)
+        if isinstance(message, bytes):
+            import msgpack
+            message = msgpack.unpackb(message, raw=False)
+        else:
+            message = json.loads(message)
         assert message["type"] == "user_event"
         component = self._components[message["comp_id"]]
-        component.user_event(message["user_event"])
-
-    def write_message(self, string):
+        user_event = message["user_event"]
+        with metrics.timer(metrics.user_event_seconds, type(component).__name__):
+            if self.profiler is None or not component._profiled:
+                component.user_event(user_event)
+            else:
+                fields = ",".join(sorted(user_event)) if isinstance(user_event, dict) else ""
+                self.profiler.run((type(component).__name__, fields, "user_event"),
+                                  component.user_event, user_event)
+
+    def encode(self, message):
+        """Serializes a message for write_message, components being referred
+        to by their id"""
+        with metrics.timer(metrics.encode_seconds):
+            if not self.packed:
+                data = JSONEncoder().encode(message)
+            else:
+                import msgpack
+                data = _Packed(msgpack.packb(message, default=_pack_component, use_bin_type=True))
+        metrics.messages.inc(message["type"])
+        metrics.message_bytes.inc(message["type"], amount=len(data))
+        return data
+
+    def write_message(self, string, conflate=None):
+        """Messages are buffered and sent together once per IOLoop tick.
+        While the client is slow to receive them, a message replaces the pending
+        one with the same conflate key. A ("pin", comp_id, fields) key instead
+        keeps the pending state changes of these fields from being replaced."""
         if self.closed: return
+        if self._held is not None:
+            self._held.append([string, conflate])
+            return
+        self._enqueue([[string, conflate]])
+
+    def _enqueue(self, entries):
+        with self._outbox_lock:
+            scheduled = bool(self._outbox)
+            backed_up = self._in_flight > self.high_water
+            for entry in entries:
+                message, key = entry
+                if key is not None and key[0] == "pin":
+                    for other in [other for other in self._conflatable
+                                  if other[0] == "state" and other[1] == key[1] and other[2] & key[2]]:
+                        del self._conflatable[other]
+                elif backed_up and key is not None:
+                    replaced = self._conflatable.get(key)
+                    if replaced is not None and replaced[0] is not None:
+                        self._pending -= len(replaced[0])
+                        replaced[0] = None
+                        self.conflated += 1
+                        metrics.conflated.inc()
+                    self._conflatable[key] = entry
+                self._pending += len(message)
+                self._outbox.append(entry)
+            overflow = self._pending > self.max_pending
+        if overflow:
+            self._drop()
+        elif not scheduled and entries:
+            self._loop.add_callback(self.flush)
+
+    def _drop(self):
+        """The client cannot keep up, forget about it rather than about memory"""
+        with self._outbox_lock:
+            dropped = sum(message is not None for message, _ in self._outbox)
+            self.dropped += dropped
+            self._outbox, self._conflatable, self._pending = [], {}, 0
+        metrics.dropped.inc(amount=dropped)
+        self.closed = True
+        self._loop.add_callback(self._socket.close)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """State changes of all components are merged until the outermost
+        transaction ends. Each component then notifies its changes once, and
+        all the resulting messages are sent in a single frame."""
+        with self:
+            if self._transaction is not None:
+                yield
+                return
+            self._transaction = {}
+            self._held = []
+            try:
+                yield
+            finally:
+                try:
+                    self._commit()
+                finally:
+                    self._transaction = None
+                    held, self._held = self._held, None
+                    self._enqueue(held)
+
+    def _join(self, component):
+        if component._id not in self._transaction:
+            component._begin_batch()
+            self._transaction[component._id] = component
+
+    def _commit(self):
+        # Changes made by the listeners are merged in a new round
+        while self._transaction:
+            components, self._transaction = list(self._transaction.values()), {}
+            try:
+                for component in components:
+                    component._end_batch()
+            except BaseException:
+                # Do not leave components batching if a listener failed
+                for component in [*components, *self._transaction.values()]:
+                    component._batch = component._batch_events = None
+                raise
+
+    def write_binary(self, header, data, conflate=None):
+        """Binary frames are queued with the other messages to keep ordering"""
+        if self.packed:
+            # MessagePack carries binary data as is, blobs are plain messages
+            self.write_message(self.encode(dict(header, type="blob", data=data)), conflate=conflate)
+            return
+        header = json.dumps(header).encode("utf-8")
+        frame = struct.pack(">I", len(header)) + header + data
+        metrics.messages.inc("blob")
+        metrics.message_bytes.inc("blob", amount=len(frame))
+        self.write_message(frame, conflate=conflate)
+
+    def flush(self):
+        with self._outbox_lock:
+            if self._in_flight > self.high_water:
+                return                                 # Resumed by _drained
+            entries, self._outbox, self._conflatable = self._outbox, [], {}
+            self._pending = 0
+        messages = [message for message, _ in entries if message is not None]
+        if self.closed or not messages: return
         try:
-            self._socket.write_message(string)
+            for kind, group in itertools.groupby(messages, type):
+                group = list(group)
+                if kind is _Packed:
+                    self._write(group[0] if len(group) == 1 else _pack_array(group), binary=True)
+                elif kind is bytes:
+                    for frame in group:
+                        self._write(frame, binary=True)
+                else:
+                    # Messages are already encoded, a batch is simply their JSON array
+                    self._write(group[0] if len(group) == 1 else "[{}]".format(",".join(group)))
         except tornado.websocket.WebSocketClosedError:
             self.closed = True
 
+    def _write(self, frame, binary=False):
+        future = self._socket.write_message(frame, binary=binary)
+        if future is not None:
+            self._in_flight += len(frame)
+            future.add_done_callback(functools.partial(self._drained, len(frame)))
+
+    def _drained(self, size, future):
+        if not future.cancelled():
+            future.exception()                         # Closed sockets are handled on write
+        self._in_flight -= size
+        if self._in_flight <= self.high_water and self._outbox:
+            self.flush()
+
     def add_wrapper(self, ctx_manager, name):
         assert self.__wrappers.get(name, None) is None
         self.__wrappers[name] = ctx_manager
@@ -201,10 +622,9 @@ class Session:
             self.__entered.pop(name).__exit__(None, None, None)
 
     def __enter__(self):
-        Session.__lock.acquire()
+        self.__lock.acquire()
         if self.__within == 0:
-            self.__old_session = Session._current
-            Session._current = self
+            self.__token = _current_session.set(self)
             for name, ctx_manager in self.__wrappers.items():
                 if isinstance(ctx_manager, functools.partial):
                     ctx_manager = ctx_manager()
@@ -219,8 +639,8 @@ class Session:
                 _, ctx_manager = self.__entered.popitem()
                 if ctx_manager.__exit__(exc_type, exc_value, traceback):
                     exc_type = exc_value = traceback = None
-            Session._current = self.__old_session
-        Session.__lock.release()
+            _current_session.reset(self.__token)
+        self.__lock.release()
 
 
 _js_cls_parser = re.compile(r'^class (?P<name>[a-zA-Z_]+) *(?:\((?P<base>[^\)]*)\))?')
@@ -254,28 +674,226 @@ class JSClass:
 JSSession = JSClass('''
 class JSSession {
     constructor(url) {
-        this.ws = new WebSocket(url)
-        this.ws.onmessage = (evt) => this.on_message(JSON.parse(evt.data))            
+        // The server picks the encoding of the messages among these
+        this.ws = new WebSocket(url, ["pyplet.msgpack", "pyplet.json"])
+        this.ws.binaryType = "arraybuffer"
+        this.ws.onmessage = (evt) => {
+            if (!(evt.data instanceof ArrayBuffer)) {
+                this.on_frame(JSON.parse(evt.data))
+            } else if (this.ws.protocol === "pyplet.msgpack") {
+                this.on_frame(this.unpack(evt.data))
+            } else {
+                this.on_binary(evt.data)
+            }
+        }
         this.ws.onclose = (evt) => document.getElementsByTagName("title")[0].innerText += "*"
-        this.classes = {}
+        // Views of the bundle loaded by the page, the others are sent inline
+        this.classes = Object.assign({}, window.pyplet_classes)
         this.components = {}
+        this.urls = {}
         this.i = 0
     }
 
     user_event(comp, event) {
-        this.ws.send(JSON.stringify({
+        let message = {
             type: "user_event",
             comp_id: comp._comp_id,
             user_event: event,
-        }))
+        }
+        if (this.ws.protocol === "pyplet.msgpack") {
+            this.ws.send(this.pack(message))
+        } else {
+            this.ws.send(JSON.stringify(message))
+        }
+    }
+
+    pack(value) {
+        // MessagePack encoder for user events, sizes always take 32 bits
+        let chunks = []
+        let push = (type, size, set) => {
+            let view = new DataView(new ArrayBuffer(1 + size))
+            view.setUint8(0, type)
+            if (set) {
+                set(view)
+            }
+            chunks.push(new Uint8Array(view.buffer))
+        }
+        let write = (value) => {
+            if (value === null || value === undefined) {
+                push(0xc0, 0)
+            } else if (typeof value === "boolean") {
+                push(value ? 0xc3 : 0xc2, 0)
+            } else if (typeof value === "number") {
+                if (!Number.isSafeInteger(value)) {
+                    push(0xcb, 8, (view) => view.setFloat64(1, value))
+                } else if (value < -0x80000000) {
+                    push(0xd3, 8, (view) => view.setBigInt64(1, BigInt(value)))
+                } else if (value < 0) {
+                    push(0xd2, 4, (view) => view.setInt32(1, value))
+                } else if (value > 0xffffffff) {
+                    push(0xcf, 8, (view) => view.setBigUint64(1, BigInt(value)))
+                } else {
+                    push(0xce, 4, (view) => view.setUint32(1, value))
+                }
+            } else if (typeof value === "string") {
+                let data = new TextEncoder().encode(value)
+                push(0xdb, 4, (view) => view.setUint32(1, data.length))
+                chunks.push(data)
+            } else if (Array.isArray(value)) {
+                push(0xdd, 4, (view) => view.setUint32(1, value.length))
+                for (let item of value) {
+                    write(item)
+                }
+            } else {
+                let keys = Object.keys(value).filter((key) => value[key] !== undefined)
+                push(0xdf, 4, (view) => view.setUint32(1, keys.length))
+                for (let key of keys) {
+                    write(key)
+                    write(value[key])
+                }
+            }
+        }
+        write(value)
+        let out = new Uint8Array(chunks.reduce((size, chunk) => size + chunk.length, 0))
+        let pos = 0
+        for (let chunk of chunks) {
+            out.set(chunk, pos)
+            pos += chunk.length
+        }
+        return out
+    }
+
+    unpack(buffer) {
+        // MessagePack decoder, bin values become Uint8Arrays
+        let view = new DataView(buffer)
+        let bytes = new Uint8Array(buffer)
+        let decoder = new TextDecoder()
+        let pos = 0
+        let take = (size) => {
+            pos += size
+            return pos - size
+        }
+        let str = (n) => decoder.decode(bytes.subarray(take(n), pos))
+        let bin = (n) => bytes.slice(take(n), pos)
+        let array = (n) => {
+            let items = []
+            for (let i = 0; i < n; i++) {
+                items.push(read())
+            }
+            return items
+        }
+        let map = (n) => {
+            let items = {}
+            for (let i = 0; i < n; i++) {
+                let key = read()
+                items[key] = read()
+            }
+            return items
+        }
+        let read = () => {
+            let type = view.getUint8(take(1))
+            if (type < 0x80) return type
+            if (type < 0x90) return map(type & 0x0f)
+            if (type < 0xa0) return array(type & 0x0f)
+            if (type < 0xc0) return str(type & 0x1f)
+            if (type >= 0xe0) return type - 0x100
+            switch (type) {
+                case 0xc0: return null
+                case 0xc2: return false
+                case 0xc3: return true
+                case 0xc4: return bin(view.getUint8(take(1)))
+                case 0xc5: return bin(view.getUint16(take(2)))
+                case 0xc6: return bin(view.getUint32(take(4)))
+                case 0xca: return view.getFloat32(take(4))
+                case 0xcb: return view.getFloat64(take(8))
+                case 0xcc: return view.getUint8(take(1))
+                case 0xcd: return view.getUint16(take(2))
+                case 0xce: return view.getUint32(take(4))
+                case 0xcf: return Number(view.getBigUint64(take(8)))
+                case 0xd0: return view.getInt8(take(1))
+                case 0xd1: return view.getInt16(take(2))
+                case 0xd2: return view.getInt32(take(4))
+                case 0xd3: return Number(view.getBigInt64(take(8)))
+                case 0xd9: return str(view.getUint8(take(1)))
+                case 0xda: return str(view.getUint16(take(2)))
+                case 0xdb: return str(view.getUint32(take(4)))
+                case 0xdc: return array(view.getUint16(take(2)))
+                case 0xdd: return array(view.getUint32(take(4)))
+                case 0xde: return map(view.getUint16(take(2)))
+                case 0xdf: return map(view.getUint32(take(4)))
+            }
+            throw new Error("Unsupported MessagePack type " + type)
+        }
+        return read()
+    }
+
+    on_binary(buffer) {
+        let length = new DataView(buffer).getUint32(0)
+        let header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, length)))
+        this.on_blob(header, new Uint8Array(buffer, 4+length))
+    }
+
+    on_blob(header, data) {
+        let blob = new Blob([data], {type: header.mime})
+        let urls = this.urls[header.comp_id] = this.urls[header.comp_id] || {}
+        if (urls[header.field]) {
+            URL.revokeObjectURL(urls[header.field])
+        }
+        urls[header.field] = URL.createObjectURL(blob)
+        this.on_message({
+            type: "state_change",
+            comp_id: header.comp_id,
+            state_change: {[header.field]: urls[header.field]},
+        })
+    }
+
+    apply_patch(value, ops) {
+        for (let [op, path, arg] of ops) {
+            let parent = value
+            for (let key of path.slice(0, -1)) {
+                parent = parent[key]
+            }
+            let key = path[path.length-1]
+            if (op === "replace") {
+                parent[key] = arg
+            } else if (op === "insert") {
+                parent.splice(key, 0, ...arg)
+            } else if (op === "delete") {
+                if (Array.isArray(parent)) {
+                    parent.splice(key, arg)
+                } else {
+                    delete parent[key]
+                }
+            }
+        }
+    }
+
+    on_frame(frame) {
+        if (Array.isArray(frame)) {
+            for (let message of frame) {
+                this.on_message(message)
+            }
+        } else {
+            this.on_message(frame)
+        }
     }
 
     on_message(message) {
         this.i = this.i+1
         // console.log(this.i, message)
         if (message.type === "state_change") {
-            Object.assign(this.components[message.comp_id], message.state_change)
-            this.components[message.comp_id].state_change(message.state_change)
+            let component = this.components[message.comp_id]
+            let state_change = message.state_change
+            for (let key in message.state_patch || {}) {
+                let ops = message.state_patch[key]
+                this.apply_patch(component[key], ops)
+                // Views may apply a patch themselves instead of handling the full value
+                if (!(component.state_patch && component.state_patch(key, ops))) {
+                    state_change[key] = component[key]
+                }
+            }
+            Object.assign(component, state_change)
+            component.state_change(state_change)
         } else if (message.type === "new") {
             let comp_id = message.comp_id
             let Cls = this.classes[message.clss]
@@ -283,6 +901,8 @@ class JSSession {
             component._comp_id = comp_id
             this.components[comp_id] = component
             // component.handle(message.state)
+        } else if (message.type === "blob") {
+            this.on_blob(message, message.data)
         } else if (message.type === "class") {
             let script = document.createElement('script')
             //script.src = '/classes/'+message.clss
@@ -290,6 +910,10 @@ class JSSession {
             document.body.appendChild(script)
             //this.classes[message.clss] = (new Function("return "+message.defn))()
         } else if (message.type === "delete") {
+            for (let url of Object.values(this.urls[message.comp_id] || {})) {
+                URL.revokeObjectURL(url)
+            }
+            delete this.urls[message.comp_id]
             delete this.components[message.comp_id]
         }
     }
@@ -297,6 +921,28 @@ class JSSession {
 ''')
 
 
+class _Packed(bytes):
+    """A MessagePack encoded message, as opposed to a binary frame"""
+
+
+def _pack_component(o):
+    if isinstance(o, Component):
+        return {"comp_id": o._id}
+    raise TypeError("cannot serialize {!r}".format(o))
+
+
+def _pack_array(packed):
+    """MessagePack array of already packed messages"""
+    n = len(packed)
+    if n < 16:
+        header = struct.pack(">B", 0x90 | n)
+    elif n < 2**16:
+        header = struct.pack(">BH", 0xdc, n)
+    else:
+        header = struct.pack(">BI", 0xdd, n)
+    return header + b"".join(packed)
+
+
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, Component):
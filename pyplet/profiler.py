@@ -0,0 +1,133 @@
+from .primitives import Component, JSClass
+
+import collections
+import cProfile
+import time
+import os
+
+
+class Profiler:
+    """Time spent in the listeners and user events of a session, per component
+    class, fields and callback, along with the functions it is spent in"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.callbacks = collections.defaultdict(lambda: [0, 0.0, 0.0])   # [calls, total, max]
+        self._profile = cProfile.Profile()
+        self._depth = 0
+
+    def run(self, key, f, *args):
+        """Calls f(*args), key being (component class, fields, callback).
+        Nested callbacks are timed separately, but profiled once."""
+        outermost = self._depth == 0
+        if outermost:
+            try:
+                self._profile.enable()
+            except ValueError:
+                # Since Python 3.12, only one profiler can be active at a time
+                outermost = False
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            return f(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._depth -= 1
+            if outermost:
+                self._profile.disable()
+            stats = self.callbacks[key]
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+    def report(self, n=20):
+        """The n callbacks taking the most time, as rows (component, fields,
+        callback, calls, total ms, mean ms, max ms), and the n functions with
+        the most time of their own, as rows (function, calls, own ms,
+        cumulative ms)"""
+        callbacks = sorted(self.callbacks.items(), key=lambda item: -item[1][1])[:n]
+        self._profile.create_stats()
+        functions = sorted(self._profile.stats.items(), key=lambda item: -item[1][2])[:n]
+        return ([[*key, calls, _ms(total), _ms(total / calls), _ms(longest)]
+                 for key, (calls, total, longest) in callbacks],
+                [["{}:{}({})".format(os.path.basename(file), line, name), calls, _ms(own), _ms(cumulative)]
+                 for (file, line, name), (_, calls, own, cumulative, _) in functions])
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+class ProfileReport(Component):
+    """Callbacks of the session taking the most time, and the functions they
+    spend it in. Creating a report starts profiling its session."""
+    _profiled = False
+
+    def init(self, n=20):
+        self._profiler = self._session.profile()
+        self._n = n
+        self.refresh()
+
+    def refresh(self):
+        callbacks, functions = self._profiler.report(self._n)
+        self.update(callbacks=callbacks, functions=functions)
+
+    def user_event(self, user_event):
+        assert len(user_event) == 1 and user_event.get("action") in ("refresh", "reset")
+        if user_event["action"] == "reset":
+            self._profiler.reset()
+        self.refresh()
+
+    __view__ = JSClass('''
+    class ProfileReportView {
+        constructor() {
+            this.domNode = document.createElement("div")
+            for (let action of ["refresh", "reset"]) {
+                let button = document.createElement("button")
+                button.className = "button small"
+                button.style.marginRight = "0.5em"
+                button.innerText = action[0].toUpperCase() + action.slice(1)
+                button.onclick = () => g.session.user_event(this, {"action": action})
+                this.domNode.appendChild(button)
+            }
+            this.callbacks = this.table(["Component", "Fields", "Callback", "Calls",
+                                         "Total (ms)", "Mean (ms)", "Max (ms)"])
+            this.functions = this.table(["Function", "Calls", "Own (ms)", "Cumulative (ms)"])
+        }
+
+        table(columns) {
+            let table = document.createElement("table")
+            let head = table.createTHead().insertRow()
+            for (let column of columns) {
+                let cell = document.createElement("th")
+                cell.innerText = column
+                head.appendChild(cell)
+            }
+            table.createTBody()
+            this.domNode.appendChild(table)
+            return table
+        }
+
+        fill(table, rows) {
+            let body = table.tBodies[0]
+            body.innerHTML = ""
+            for (let row of rows) {
+                let line = body.insertRow()
+                for (let value of row) {
+                    line.insertCell().innerText = value
+                }
+            }
+        }
+
+        state_change(state_change) {
+            if (state_change.callbacks !== undefined) {
+                this.fill(this.callbacks, state_change.callbacks)
+            }
+            if (state_change.functions !== undefined) {
+                this.fill(this.functions, state_change.functions)
+            }
+        }
+    }
+    ''')
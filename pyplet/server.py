@@ -1,16 +1,26 @@
 import tornado.web
 import tornado.autoreload
+import tornado.httpserver
 import tornado.websocket
+import tornado.process
+import tornado.netutil
 import tornado.ioloop
+import tornado.escape
 
 from .primitives import JSClass, JSSession, Session
 from .widgets import Root
 from .feed import Feed
+from . import vendor
+from . import metrics
+from . import tiles, profiler  # noqa: F401 (their views belong in the bundle from the start)
 
+import concurrent.futures
 import collections
 import contextlib
+import hashlib
 import functools
 import textwrap
+import argparse
 import glob
 import sys
 import os
@@ -31,17 +41,8 @@ index_html = subst("""
         <meta charset="utf-8" />
         <title><<APP>></title>
 
-        <link rel="stylesheet" href="http://code.jquery.com/ui/1.12.1/themes/base/jquery-ui.min.css">
-        <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/foundation-sites@6.5.3/dist/css/foundation.min.css" integrity="sha256-xpOKVlYXzQ3P03j397+jWFZLMBXLES3IiryeClgU5og= sha384-gP4DhqyoT9b1vaikoHi9XQ8If7UNLO73JFOOlQV1RATrA7D0O7TjJZifac6NwPps sha512-AKwIib1E+xDeXe0tCgbc9uSvPwVYl6Awj7xl0FoaPFostZHOuDQ1abnDNCYtxL/HWEnVOMrFyf91TDgLPi9pNg==" crossorigin="anonymous">
-        <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.44.0/codemirror.min.css">
-
-        <script src="https://cdn.jsdelivr.net/npm/jquery@3.3.1/dist/jquery.min.js"></script>
-        <script src="http://code.jquery.com/ui/1.12.1/jquery-ui.js"></script>
-        <script src="https://d3js.org/d3.v5.min.js"></script>
-        <script src="https://cdn.jsdelivr.net/npm/foundation-sites@6.5.3/dist/js/foundation.min.js" integrity="sha256-/PFxCnsMh+nTuM0k3VJCRch1gwnCfKjaP8rJNq5SoBg= sha384-9ksAFjQjZnpqt6VtpjMjlp2S0qrGbcwF/rvrLUg2vciMhwc1UJJeAAOLuJ96w+Nj sha512-UMSn6RHqqJeJcIfV1eS2tPKCjzaHkU/KqgAnQ7Nzn0mLicFxaVhm9vq7zG5+0LALt15j1ljlg8Fp9PT1VGNmDw==" crossorigin="anonymous"></script>
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/underscore.js/1.9.1/underscore-min.js"></script>
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.44.0/codemirror.min.js"></script>
-        <script src="https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.44.0/mode/python/python.min.js"></script>
+        <<ASSETS>>
+        <script src="/bundle/<<BUNDLE>>.js"></script>
         <style type="text/css">
             .stderr {
                 color: red;
@@ -55,7 +56,7 @@ index_html = subst("""
         <<TOP_BAR>>
         <script>
             <<JSSession>>
-            g = {session: new JSSession("ws://"+location.host+"/websocket/<<APP>>")}
+            g = {session: new JSSession("ws://"+location.host+"/websocket/<<APP>>?bundle="+(window.pyplet_bundle || ""))}
             $(document).foundation();
         </script>
     </body>
@@ -88,69 +89,199 @@ def get_top_bar(files):
     """, ITEMS="".join(items))
 
 
+_compiled_apps = {}
+
+
+def compile_app(path):
+    """Compiled code is shared by all connections until the file changes"""
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _compiled_apps.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    with open(path, "r") as file:
+        src = file.read()
+    code = compile(src, path, "exec")
+    _compiled_apps[path] = (key, code)
+    return code
+
+
+Bundle = collections.namedtuple("Bundle", "refs source version")
+_bundle = None
+
+
+def view_bundle():
+    """Script defining every view encountered so far. It is rebuilt, under a
+    new version, when modules imported since then define more views."""
+    global _bundle
+    refs = tuple(ref for ref in JSClass._encountered if ref != JSSession.ref)
+    if _bundle is None or _bundle.refs != refs:
+        source = "var pyplet_classes = {};\n" + "".join(
+            'pyplet_classes["{}"] = {}\n'.format(ref, JSClass._encountered[ref].defn)
+            for ref in refs)
+        version = hashlib.sha256(source.encode()).hexdigest()[:16]
+        # The page tells which version it actually loaded when connecting
+        source += 'var pyplet_bundle = "{0}"\n//# sourceURL=/bundle/{0}.js\n'.format(version)
+        _bundle = Bundle(refs, source, version)
+    return _bundle
+
+
 @contextlib.contextmanager
 def session_into_feed(feed):
     import pyplet
-    _ = pyplet.root
-    assert _ is None
-    pyplet.root = feed
-    with feed.enter():
-        yield
-    pyplet.root = _
+    token = pyplet._root.set(feed)
+    try:
+        with feed.enter():
+            yield
+    finally:
+        pyplet._root.reset(token)
+
+
+def executor_type(spec):
+    """Parses the --executor option: "inline" or "thread:N"."""
+    kind, _, workers = spec.partition(":")
+    if kind == "inline" and not workers:
+        return None
+    if kind == "thread":
+        return concurrent.futures.ThreadPoolExecutor(int(workers) if workers else None,
+                                                     thread_name_prefix="pyplet")
+    if kind == "process":
+        # Components, their listeners and the socket live in the server process
+        raise argparse.ArgumentTypeError("sessions cannot be shared with other processes, use thread:N")
+    raise argparse.ArgumentTypeError("unknown executor {!r}".format(spec))
 
 
 def make_app(config):
+    executor = getattr(config, "executor", None)
+    vendor_dir = getattr(config, "vendor", None)
+
+    compression_level = getattr(config, "compression_level", 0)
+    compression_mem_level = getattr(config, "compression_mem_level", 8)
+    compression_min_size = getattr(config, "compression_min_size", 0)
+    encoding = getattr(config, "encoding", "json")
+
     class SocketHandler(tornado.websocket.WebSocketHandler):
         instances = dict()
 
+        def get_compression_options(self):
+            if not compression_level:
+                return None
+            return {"compression_level": compression_level, "mem_level": compression_mem_level}
+
+        def select_subprotocol(self, subprotocols):
+            # Browsers refuse the connection if none of the offered protocols
+            # is picked, older pages do not offer any
+            for protocol in ("pyplet." + encoding, "pyplet.json"):
+                if protocol in subprotocols:
+                    return protocol
+            return None
+
+        def write_message(self, message, binary=False):
+            # The compressor and byte counters are tornado internals (checked
+            # with tornado 6), frames are sent and counted as is without them
+            connection = self.ws_connection
+            compressor = getattr(connection, "_compressor", None)
+            if compressor is None or len(message) >= compression_min_size:
+                future = super().write_message(message, binary=binary)
+            else:
+                # Deflating small frames costs more than it saves, and
+                # permessage-deflate allows sending them as is
+                connection._compressor = None
+                try:
+                    future = super().write_message(message, binary=binary)
+                finally:
+                    connection._compressor = compressor
+            raw_bytes = getattr(connection, "_message_bytes_out", None)
+            wire_bytes = getattr(connection, "_wire_bytes_out", None)
+            if raw_bytes is None or wire_bytes is None:
+                size = len(tornado.escape.utf8(message))
+                raw_bytes, wire_bytes = self.session.raw_bytes + size, self.session.wire_bytes + size
+            metrics.raw_bytes.inc(amount=raw_bytes - self.session.raw_bytes)
+            metrics.wire_bytes.inc(amount=wire_bytes - self.session.wire_bytes)
+            self.session.raw_bytes = raw_bytes
+            self.session.wire_bytes = wire_bytes
+            return future
+
         def open(self):
             self.id = id(self)
             self.instances[self.id] = self
-            self.session = Session(self.id, self)
-            with self.session:
-                app_path = self.request.uri[len("/websocket/"):]
-                available_apps = glob.glob(config.apps)
-
-                feed = Feed()
-                Root(html="<div><h3>{}</h3><div class='root'></div></div>"
-                          .format(app_path),
-                     children=[feed])
-                self.session.add_wrapper(functools.partial(session_into_feed, feed), "feed_wrapper")
-                try:
-                    if app_path not in available_apps:
-                        raise FileNotFoundError()
-                    with open(app_path, "r") as file:
-                        src = file.read()
-                except FileNotFoundError:
-                    print("Application {!r} not found</p>".format(app_path),
-                          file=sys.stderr)
-                else:
-                    try:
-                        code = compile(src, app_path, "exec")
-                        self.session.env = {"__file__": app_path, "__root__": feed}
-                        exec(code, self.session.env)
-                    except:
-                        import traceback
-                        traceback.print_exc()
+            metrics.sessions.inc()
+            self.session = Session(self.id, self, executor=executor,
+                                   high_water=getattr(config, "high_water", 2**20),
+                                   max_pending=getattr(config, "max_pending", 2**26))
+            self.session.packed = self.selected_subprotocol == "pyplet.msgpack"
+            if getattr(config, "profile", False):
+                self.session.profile()
+            bundle = view_bundle()
+            if self.get_argument("bundle", None) == bundle.version:
+                self.session.bundled = frozenset(bundle.refs)
+            self.session.submit(self._run_app, self.request.path[len("/websocket/"):])
 
-        def on_message(self, message):
-            with self.session:
+        def _run_app(self, app_path):
+            available_apps = glob.glob(config.apps)
+
+            feed = Feed()
+            Root(html="<div><h3>{}</h3><div class='root'></div></div>"
+                      .format(app_path),
+                 children=[feed])
+            self.session.add_wrapper(functools.partial(session_into_feed, feed), "feed_wrapper")
+            try:
+                if app_path not in available_apps:
+                    raise FileNotFoundError()
+                code = compile_app(app_path)
+            except FileNotFoundError:
+                print("Application {!r} not found</p>".format(app_path),
+                      file=sys.stderr)
+            except:
+                import traceback
+                traceback.print_exc()
+            else:
                 try:
-                    self.session.on_message(message)
+                    self.session.env = {"__file__": app_path, "__root__": feed}
+                    exec(code, self.session.env)
                 except:
                     import traceback
-                    Root(html="""<pre style="color:red">{}</pre>"""
-                              .format(traceback.format_exc()))
+                    traceback.print_exc()
+
+        def on_message(self, message):
+            self.session.submit(self._on_message, message)
+
+        def _on_message(self, message):
+            try:
+                self.session.on_message(message)
+            except:
+                import traceback
+                Root(html="""<pre style="color:red">{}</pre>"""
+                          .format(traceback.format_exc()))
 
         def on_close(self):
             self.session.closed = True
+            metrics.sessions.dec()
             self.instances.pop(self.id)
 
     class MainHandler(tornado.web.RequestHandler):
         def get(self):
             available_apps = glob.glob(config.apps)
             top_bar = get_top_bar(available_apps) if config.top_bar else ""
-            self.write(subst(index_html, TOP_BAR=top_bar, APP=self.request.uri[1:]))
+            assets = "\n".join(vendor.tag(asset, self.static_url(asset.name) if vendor_dir else None)
+                                for asset in vendor.ASSETS)
+            self.write(subst(index_html, TOP_BAR=top_bar, ASSETS=assets,
+                             BUNDLE=view_bundle().version, APP=self.request.path[1:]))
+
+    class BundleHandler(tornado.web.RequestHandler):
+        def get(self, version):
+            bundle = view_bundle()
+            if version != bundle.version:
+                raise tornado.web.HTTPError(404)
+            # A version always has the same content, the ETag covers revalidation
+            self.set_header("Content-Type", "application/javascript; charset=UTF-8")
+            self.set_header("Cache-Control", "public, max-age=31536000, immutable")
+            self.write(bundle.source)
+
+    class MetricsHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.write(metrics.render())
 
     class ClassesHandler(tornado.web.RequestHandler):
         def get(self):
@@ -158,27 +289,79 @@ def make_app(config):
             jsclass = JSClass._encountered.get(ref)
             self.write(subst('g.session.classes["<<REF>>"] = <<CLASS>>', REF=ref, CLASS=jsclass.defn))
 
+    settings = dict(debug=bool(getattr(config, "debug", True)), compress_response=True)
+    if vendor_dir:
+        settings.update(static_path=vendor_dir, static_url_prefix="/vendor/")
     app = tornado.web.Application([
         (r"/websocket/.*", SocketHandler),
         (r"/classes/.*", ClassesHandler),
+        (r"/bundle/([0-9a-f]+)\.js", BundleHandler),
+        (r"/metrics", MetricsHandler),
         (r"/.*", MainHandler),
-    ], debug=True)
+    ], **settings)
     return app
 
 
+def listen(config):
+    """Serves the app on config.port, from config.workers forked processes if
+    not 1. Returns the HTTP server of the process, and its worker id (None
+    without workers)."""
+    if config.workers == 1:
+        return make_app(config).listen(config.port, address=config.host), None
+    # A session lives entirely in the process holding its websocket, and the
+    # page does not depend on it: any worker can accept any connection.
+    # Autoreload cannot run in forked workers.
+    config.debug = 0
+    sockets = tornado.netutil.bind_sockets(config.port, address=config.host)
+    worker = tornado.process.fork_processes(config.workers)
+    server = tornado.httpserver.HTTPServer(make_app(config))
+    server.add_sockets(sockets)
+    return server, worker
+
+
 if __name__ == "__main__":
-    import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", default=3000, type=int)
     parser.add_argument("--apps", default="*/app_*.py")
     parser.add_argument("--top-bar", default=1, type=int)
     parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--executor", default="inline", type=executor_type,
+                        help="where callbacks run: inline (on the IOLoop) or thread:N")
+    parser.add_argument("--high-water", default=2**20, type=int,
+                        help="bytes written to a client before its state changes get conflated")
+    parser.add_argument("--max-pending", default=2**26, type=int,
+                        help="bytes queued for a client before it gets disconnected")
+    parser.add_argument("--debug", default=1, type=int,
+                        help="tornado debug mode, restarting the server when the code changes")
+    parser.add_argument("--workers", default=1, type=int,
+                        help="processes sharing the port, 0 for one per CPU")
+    parser.add_argument("--compression-level", default=6, type=int,
+                        help="permessage-deflate level of the websocket, 0 to disable it")
+    parser.add_argument("--compression-mem-level", default=8, type=int,
+                        help="zlib memory level (1-9) of each session's compressor")
+    parser.add_argument("--compression-min-size", default=256, type=int,
+                        help="bytes below which messages are sent uncompressed")
+    parser.add_argument("--encoding", default="json", choices=["json", "msgpack"],
+                        help="encoding of the messages, msgpack requiring the msgpack package")
+    parser.add_argument("--profile", default=0, type=int,
+                        help="profile the callbacks of every session, see pyplet.profiler.ProfileReport")
+    parser.add_argument("--vendor", default=None, metavar="DIR",
+                        help="serve the third-party assets from DIR instead of their CDN "
+                             "(filled by python -m pyplet.vendor DIR)")
     args = parser.parse_args()
+    if args.encoding == "msgpack":
+        try:
+            import msgpack  # noqa: F401
+        except ImportError:
+            parser.error("--encoding msgpack requires the msgpack package")
+    if args.vendor and vendor.missing(args.vendor):
+        parser.error("missing from {}: {}".format(args.vendor, ", ".join(vendor.missing(args.vendor))))
 
-    app = make_app(args)
-    app.listen(args.port, address=args.host)
+    server, worker = listen(args)
+    worker = "" if worker is None else f" (worker {worker})"
 
     from datetime import datetime
-    print(f"\rServer (re)started on {datetime.now().ctime()} on http://{args.host}:{args.port}", end="")
+    print(f"\rServer (re)started on {datetime.now().ctime()} on http://{args.host}:{args.port}{worker}",
+          end="" if args.workers == 1 else "\n")
 
     tornado.ioloop.IOLoop.current().start()
\ No newline at end of file
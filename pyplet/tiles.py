@@ -0,0 +1,313 @@
+from .primitives import JSClass
+from .widgets import Image
+from .feed import img_to_rgba, encode_image, parse_codec
+
+import numpy as np
+
+
+def _runs(row):
+    """(start, stop) of the runs of True values in a boolean row"""
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], row.view(np.int8), [0]))))
+    return list(zip(edges[0::2].tolist(), edges[1::2].tolist()))
+
+
+def dirty_rects(old, new, block=32):
+    """Rectangles (x, y, w, h) covering the blocks of block*block pixels that
+    differ between the images old and new, and the ratio of such blocks"""
+    h, w = new.shape[:2]
+    gh, gw = -(-h // block), -(-w // block)
+    changed = np.zeros((gh*block, gw*block), bool)
+    changed[:h, :w] = (old != new).reshape(h, w, -1).any(axis=2)
+    dirty = changed.reshape(gh, block, gw, block).any(axis=(1, 3))
+    # Horizontal runs of dirty blocks are merged with identical runs below
+    rects, open_rects = [], {}
+    for gy, row in enumerate(dirty):
+        still_open = {run: open_rects.pop(run, gy) for run in _runs(row)}
+        rects.extend((x0, y0, x1, gy) for (x0, x1), y0 in open_rects.items())
+        open_rects = still_open
+    rects.extend((x0, y0, x1, gh) for (x0, x1), y0 in open_rects.items())
+    rects = [(x0*block, y0*block, min(x1*block, w) - x0*block, min(y1*block, h) - y0*block)
+             for x0, y0, x1, y1 in rects]
+    return rects, dirty.mean()
+
+
+class _Pyramid:
+    """Levels of detail of an image, level n being downsampled by 2**n.
+    Regions of any level are converted from the source on demand, a pixel of
+    level n being the mean of 2x2 source pixels 2**(n-1) apart, so that a
+    tile costs the same at every level and no level is kept in memory."""
+
+    def __init__(self, image, scale=1, CHW=False, alpha=True):
+        image = np.asarray(image)
+        if image.ndim == 2:
+            image = image[..., None]
+        elif CHW:
+            image = np.moveaxis(image, 0, 2)
+        self.shape = image.shape[:2]
+        self._source = image
+        self._scale = scale
+        self._alpha = alpha
+
+    def n_levels(self, tile):
+        n = 1
+        while max(self.shape) >> (n-1) > tile and min(self.shape) >> n >= 1:
+            n += 1
+        return n
+
+    def region(self, level, y0, y1, x0, x1):
+        if level == 0:
+            return img_to_rgba(self._source[y0:y1, x0:x1], self._scale, alpha=self._alpha)
+        y1, x1 = min(y1, self.shape[0] >> level), min(x1, self.shape[1] >> level)
+        step, half = 1 << level, 1 << (level-1)
+        total = None
+        for dy in (0, half):
+            for dx in (0, half):
+                sample = self._source[y0*step+dy:y1*step:step, x0*step+dx:x1*step:step]
+                sample = img_to_rgba(sample, self._scale, alpha=self._alpha).astype(np.uint16)
+                total = sample if total is None else np.add(total, sample, out=total)
+        return ((total + 2) // 4).astype(np.uint8)
+
+    def tile(self, level, tx, ty, size):
+        return self.region(level, ty*size, (ty+1)*size, tx*size, (tx+1)*size)
+
+
+class TiledImage(Image):
+    """Image too large to be sent whole. The frontend can be panned (drag) and
+    zoomed (wheel), and requests the tiles of the pyramid level matching its
+    zoom for the part of the image it shows."""
+
+    def init(self, image, scale=1, CHW=False, tile=256, codec="jpeg:90", style="height:60vh"):
+        super().init(style=style)
+        self._codec = codec
+        self.tile = tile
+        self.set_image(image, scale=scale, CHW=CHW)
+
+    def set_image(self, image, scale=1, CHW=False):
+        self._pyramid = _Pyramid(image, scale=scale, CHW=CHW,
+                                 alpha=parse_codec(self._codec)[0] != "jpeg")
+        height, width = self._pyramid.shape
+        self.update(width=width, height=height,
+                    levels=self._pyramid.n_levels(self.tile),
+                    version=self._state.get("version", 0) + 1)
+
+    def user_event(self, user_event):
+        assert set(user_event) == {"tiles", "version"}
+        if user_event["version"] != self.version:
+            return
+        for level, tx, ty in user_event["tiles"]:
+            if not (0 <= level < self.levels and tx >= 0 and ty >= 0):
+                continue
+            tile = self._pyramid.tile(level, tx, ty, self.tile)
+            if tile.size == 0:
+                continue
+            field = "tile:{}:{}:{}:{}".format(self.version, level, tx, ty)
+            # Tiles only live in the frontend
+            self._send_frontend({field: encode_image(tile, self._codec)})
+
+    __view__ = JSClass('''
+    class TiledImageView {
+        constructor() {
+            this.domNode = document.createElement("div")
+            this.tiles = {}
+            this.requested = {}
+            this.zoom = null
+            this.x = 0
+            this.y = 0
+
+            function _onwheel(evt) {
+                evt.preventDefault()
+                let rect = this.domNode.getBoundingClientRect()
+                let factor = Math.pow(1.2, -Math.sign(evt.deltaY))
+                // Keep the pixel under the cursor in place
+                this.x += (evt.clientX - rect.left) / this.zoom * (1 - 1/factor)
+                this.y += (evt.clientY - rect.top) / this.zoom * (1 - 1/factor)
+                this.zoom *= factor
+                this.refresh()
+            }
+            this.domNode.addEventListener("wheel", _onwheel.bind(this))
+
+            function _onmousedown(evt) {
+                evt.preventDefault()
+                let last = [evt.clientX, evt.clientY]
+                let move = (evt) => {
+                    this.x -= (evt.clientX - last[0]) / this.zoom
+                    this.y -= (evt.clientY - last[1]) / this.zoom
+                    last = [evt.clientX, evt.clientY]
+                    this.refresh()
+                }
+                let up = () => {
+                    window.removeEventListener("mousemove", move)
+                    window.removeEventListener("mouseup", up)
+                }
+                window.addEventListener("mousemove", move)
+                window.addEventListener("mouseup", up)
+            }
+            this.domNode.addEventListener("mousedown", _onmousedown.bind(this))
+        }
+
+        refresh() {
+            if (this.domNode.clientWidth === 0) {
+                // Not displayed yet
+                setTimeout(this.refresh.bind(this), 100)
+                return
+            }
+            if (this.zoom === null) {
+                this.zoom = this.domNode.clientWidth / this.width
+            }
+            for (let key in this.tiles) {
+                this.place(this.tiles[key])
+            }
+            clearTimeout(this._request)
+            this._request = setTimeout(this.request.bind(this), 50)
+        }
+
+        request() {
+            let level = Math.max(0, Math.min(this.levels-1, Math.floor(Math.log2(1/this.zoom))))
+            let span = this.tile * Math.pow(2, level)
+            let x0 = Math.max(0, Math.floor(this.x / span))
+            let y0 = Math.max(0, Math.floor(this.y / span))
+            let x1 = Math.min(Math.ceil(this.width / span),
+                              Math.ceil((this.x + this.domNode.clientWidth / this.zoom) / span))
+            let y1 = Math.min(Math.ceil(this.height / span),
+                              Math.ceil((this.y + this.domNode.clientHeight / this.zoom) / span))
+            let tiles = []
+            for (let ty = y0; ty < y1; ty++) {
+                for (let tx = x0; tx < x1; tx++) {
+                    let key = `tile:${this.version}:${level}:${tx}:${ty}`
+                    if (!(key in this.tiles) && !this.requested[key]) {
+                        this.requested[key] = true
+                        tiles.push([level, tx, ty])
+                    }
+                }
+            }
+            if (tiles.length) {
+                g.session.user_event(this, {"tiles": tiles, "version": this.version})
+            }
+        }
+
+        place(tile) {
+            let span = Math.pow(2, tile.level)
+            tile.img.style.left = ((tile.tx * this.tile * span - this.x) * this.zoom) + "px"
+            tile.img.style.top = ((tile.ty * this.tile * span - this.y) * this.zoom) + "px"
+            tile.img.style.width = (tile.img.naturalWidth * span * this.zoom) + "px"
+        }
+
+        clear() {
+            let urls = g.session.urls[this._comp_id] || {}
+            for (let key in this.tiles) {
+                this.tiles[key].img.remove()
+                URL.revokeObjectURL(urls[key])
+                delete urls[key]
+                delete this[key]
+            }
+            this.tiles = {}
+            this.requested = {}
+            this.zoom = null
+        }
+
+        state_change(state_change) {
+            if (state_change.style !== undefined) {
+                this.domNode.setAttribute("style", state_change.style)
+                this.domNode.style.position = "relative"
+                this.domNode.style.overflow = "hidden"
+            }
+            if (state_change.version !== undefined) {
+                this.clear()
+            }
+            for (let key in state_change) {
+                if (!key.startsWith("tile:")) {
+                    continue
+                }
+                let [version, level, tx, ty] = key.split(":").slice(1).map(Number)
+                if (version !== this.version) {
+                    continue
+                }
+                let img = document.createElement("img")
+                img.style.position = "absolute"
+                // Finer levels are drawn over coarser ones
+                img.style.zIndex = 100 - level
+                let tile = {img: img, level: level, tx: tx, ty: ty}
+                img.onload = () => this.place(tile)
+                img.src = state_change[key]
+                this.tiles[key] = tile
+                this.domNode.appendChild(img)
+            }
+            if (state_change.version !== undefined) {
+                this.refresh()
+            }
+        }
+    }
+    ''')
+
+
+class LiveImage(Image):
+    """Image for frames updated in place. Only the rectangles that changed
+    since the previous frame are sent, unless more than key_ratio of the image
+    changed, and the frontend draws them on a canvas."""
+
+    def init(self, image=None, scale=1, CHW=False, codec="jpeg:90", block=32, key_ratio=0.5, style=""):
+        super().init(style=style)
+        self._codec = codec
+        self._block = block
+        self._key_ratio = key_ratio
+        self._last = None
+        self._seq = 0
+        if image is not None:
+            self.set_image(image, scale=scale, CHW=CHW)
+
+    def set_image(self, image, scale=1, CHW=False):
+        frame = img_to_rgba(image, scale=scale, CHW=CHW,
+                            alpha=parse_codec(self._codec)[0] != "jpeg")
+        h, w = frame.shape[:2]
+        rects = [(0, 0, w, h)]
+        if self._last is not None and self._last.shape == frame.shape:
+            dirty, ratio = dirty_rects(self._last, frame, self._block)
+            if ratio <= self._key_ratio:
+                rects = dirty
+        self._last = frame
+        for x, y, rw, rh in rects:
+            self._seq += 1
+            field = "rect:{}:{}:{}:{}:{}".format(self._seq, x, y, w, h)
+            self._send_frontend({field: encode_image(frame[y:y+rh, x:x+rw], self._codec)})
+
+    __view__ = JSClass('''
+    class LiveImageView {
+        constructor() {
+            this.domNode = document.createElement("canvas")
+            this.context = this.domNode.getContext("2d")
+            this.drawing = Promise.resolve()
+        }
+
+        draw(key, url) {
+            let [x, y, width, height] = key.split(":").slice(2).map(Number)
+            let img = document.createElement("img")
+            let loaded = new Promise((resolve) => {
+                img.onload = img.onerror = resolve
+            })
+            img.src = url
+            // Rectangles are decoded concurrently but drawn in order
+            this.drawing = this.drawing.then(() => loaded).then(() => {
+                if (this.domNode.width !== width || this.domNode.height !== height) {
+                    this.domNode.width = width
+                    this.domNode.height = height
+                }
+                this.context.clearRect(x, y, img.naturalWidth, img.naturalHeight)
+                this.context.drawImage(img, x, y)
+                URL.revokeObjectURL(url)
+                delete (g.session.urls[this._comp_id] || {})[key]
+                delete this[key]
+            })
+        }
+
+        state_change(state_change) {
+            for (let key in state_change) {
+                if (key.startsWith("rect:")) {
+                    this.draw(key, state_change[key])
+                }
+            }
+            if (state_change.style !== undefined) {
+                this.domNode.setAttribute("style", state_change.style)
+            }
+        }
+    }
+    ''')
@@ -0,0 +1,90 @@
+"""Third-party assets of the page.
+
+They are loaded from their CDN, unless the server is given a directory holding
+local copies (--vendor DIR), for machines without internet access. Such a
+directory is filled on a connected machine with
+
+    python -m pyplet.vendor DIR
+"""
+import collections
+import hashlib
+import base64
+import urllib.request
+import sys
+import os
+
+
+Asset = collections.namedtuple("Asset", "name url integrity")
+
+ASSETS = [
+    Asset("jquery-ui.min.css", "https://code.jquery.com/ui/1.12.1/themes/base/jquery-ui.min.css", None),
+    Asset("foundation.min.css", "https://cdn.jsdelivr.net/npm/foundation-sites@6.5.3/dist/css/foundation.min.css",
+          "sha256-xpOKVlYXzQ3P03j397+jWFZLMBXLES3IiryeClgU5og= sha384-gP4DhqyoT9b1vaikoHi9XQ8If7UNLO73JFOOlQV1RATrA7D0O7TjJZifac6NwPps sha512-AKwIib1E+xDeXe0tCgbc9uSvPwVYl6Awj7xl0FoaPFostZHOuDQ1abnDNCYtxL/HWEnVOMrFyf91TDgLPi9pNg=="),
+    Asset("codemirror.min.css", "https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.44.0/codemirror.min.css", None),
+    Asset("jquery.min.js", "https://code.jquery.com/jquery-3.3.1.min.js",
+          "sha256-FgpCb/KJQlLNfOu91ta32o/NMZxltwRo8QtmkMRdAu8="),
+    Asset("jquery-ui.min.js", "https://code.jquery.com/ui/1.12.1/jquery-ui.min.js",
+          "sha256-VazP97ZCwtekAsvgPBSUwPFKdrwD3unUfSGVYrahUqU="),
+    Asset("d3.min.js", "https://cdn.jsdelivr.net/npm/d3@5.16.0/dist/d3.min.js", None),
+    Asset("foundation.min.js", "https://cdn.jsdelivr.net/npm/foundation-sites@6.5.3/dist/js/foundation.min.js",
+          "sha256-/PFxCnsMh+nTuM0k3VJCRch1gwnCfKjaP8rJNq5SoBg= sha384-9ksAFjQjZnpqt6VtpjMjlp2S0qrGbcwF/rvrLUg2vciMhwc1UJJeAAOLuJ96w+Nj sha512-UMSn6RHqqJeJcIfV1eS2tPKCjzaHkU/KqgAnQ7Nzn0mLicFxaVhm9vq7zG5+0LALt15j1ljlg8Fp9PT1VGNmDw=="),
+    Asset("underscore-min.js", "https://cdnjs.cloudflare.com/ajax/libs/underscore.js/1.9.1/underscore-min.js", None),
+    Asset("codemirror.min.js", "https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.44.0/codemirror.min.js", None),
+    Asset("codemirror-python.min.js", "https://cdnjs.cloudflare.com/ajax/libs/codemirror/5.44.0/mode/python/python.min.js", None),
+]
+
+# Loaded by jquery-ui.min.css relative to itself, hence kept in images/
+THEME_IMAGES = [
+    Asset("images/ui-icons_{}_256x240.png".format(color),
+          "https://code.jquery.com/ui/1.12.1/themes/base/images/ui-icons_{}_256x240.png".format(color), None)
+    for color in ("444444", "555555", "777620", "777777", "cc0000", "ffffff")
+]
+
+
+def tag(asset, url=None):
+    """HTML tag loading the asset from url, or from its CDN if None"""
+    attrs = ""
+    if url is None:
+        url = asset.url
+        if asset.integrity:
+            attrs = ' integrity="{}" crossorigin="anonymous"'.format(asset.integrity)
+    if asset.name.endswith(".css"):
+        return '<link rel="stylesheet" href="{}"{}>'.format(url, attrs)
+    return '<script src="{}"{}></script>'.format(url, attrs)
+
+
+def missing(directory):
+    return [asset.name for asset in ASSETS + THEME_IMAGES
+            if not os.path.isfile(os.path.join(directory, asset.name))]
+
+
+def integrity(data, algorithm="sha384"):
+    """Subresource integrity hash of data"""
+    return "{}-{}".format(algorithm, base64.b64encode(hashlib.new(algorithm, data).digest()).decode())
+
+
+def check_integrity(asset, data):
+    for expected in (asset.integrity or "").split():
+        if integrity(data, expected.partition("-")[0]) != expected:
+            raise ValueError("{} does not match its integrity hash".format(asset.url))
+
+
+def fetch(directory):
+    for asset in ASSETS + THEME_IMAGES:
+        if not asset.url.startswith("https://"):
+            raise ValueError("{} is not fetched over https".format(asset.url))
+        with urllib.request.urlopen(asset.url) as response:
+            data = response.read()
+        check_integrity(asset, data)
+        path = os.path.join(directory, asset.name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(data)
+        # Hashes of assets not pinned yet, to be recorded in ASSETS
+        print(asset.name, len(data), "" if asset.integrity else integrity(data))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m pyplet.vendor DIR")
+    fetch(sys.argv[1])
@@ -1,66 +1,259 @@
-import tornado.ioloop
-
 from .transpiler import js_code
 from .primitives import Component, Session, JSClass
 
 import contextlib
 import functools
+import threading
+import weakref
 import datetime
+import math
+import time
 import sys
 
 
+class _RateLimit:
+    __slots__ = ("pending", "first", "deadline")
+
+    def __init__(self, pending, first, deadline):
+        self.pending = pending                         # Latest (args, kwargs) not executed yet
+        self.first = first                             # Time of the first pending call
+        self.deadline = deadline
+
+
 class _Throttler:
-    def __init__(self, f, ms=10):
-        self.f  = f
+    """Calls f at most once every ms milliseconds, with the latest arguments.
+
+    leading: the first call is executed right away
+    trailing: the latest call is executed at the end of the delay
+    debounce: the delay restarts on every call, so that f runs once calls stop,
+        or at the latest max_wait milliseconds after the first pending call
+    key: function of the arguments, calls with different keys are limited
+        separately (calls from different sessions always are)
+    """
+
+    def __init__(self, f, ms=10, leading=False, trailing=True, debounce=False, max_wait=None, key=None):
+        functools.update_wrapper(self, f)
+        self.f = f
         self.ms = ms
-        self.todo = []
-        self.session = Session._current
-        assert self.session is not None
-
-    def _do(self):
-        doing = self.todo[-1]
-        self.todo.clear()
-        with self.session:
-            doing()
+        self.leading = leading
+        self.trailing = trailing
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.key = key
+        self._limits = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.superseded = 0                            # Calls replaced by a later one
+
+    @property
+    def stats(self):
+        return {"calls": self.calls, "executions": self.executions, "superseded": self.superseded}
+
+    def _deadline(self, limit, now):
+        deadline = now + self.ms / 1000
+        if self.debounce and self.max_wait is not None and limit.first is not None:
+            deadline = min(deadline, limit.first + self.max_wait / 1000)
+        return deadline
+
+    def _schedule(self, session, key, delay):
+        session.add_timeout(datetime.timedelta(seconds=max(0, delay)), self._timeout, session, key)
 
     def __call__(self, *args, **kwargs):
-        self.todo.append(functools.partial(self.f, *args, **kwargs))
-        if len(self.todo) == 1:
-            dt = datetime.timedelta(milliseconds=self.ms)
-            tornado.ioloop.IOLoop.current().add_timeout(dt, self._do)
+        session = Session.current()
+        assert session is not None
+        key = None if self.key is None else self.key(*args, **kwargs)
+        now = time.monotonic()
+        with self._lock:
+            self.calls += 1
+            limit = self._limits.get((session, key))
+            if limit is None:
+                pending = None if self.leading else (args, kwargs)
+                limit = _RateLimit(pending, None if self.leading else now, None)
+                limit.deadline = self._deadline(limit, now)
+                self._limits[session, key] = limit
+                self._schedule(session, key, limit.deadline - now)
+            else:
+                if limit.pending is not None:
+                    self.superseded += 1
+                limit.pending = (args, kwargs)
+                if limit.first is None:
+                    limit.first = now
+                if self.debounce:
+                    # The timeout reschedules itself for the new deadline
+                    limit.deadline = self._deadline(limit, now)
+                return
+        if self.leading:
+            self._execute((args, kwargs))
+
+    def _timeout(self, session, key):
+        now = time.monotonic()
+        with self._lock:
+            limit = self._limits[session, key]
+            if now < limit.deadline and not session.closed:
+                self._schedule(session, key, limit.deadline - now)
+                return
+            pending, limit.pending, limit.first = limit.pending, None, None
+            if pending is not None and not (self.trailing and not session.closed):
+                self.superseded += 1
+                pending = None
+            if pending is not None and self.leading:
+                # Calls right after this one must still wait
+                limit.deadline = self._deadline(limit, now)
+                self._schedule(session, key, self.ms / 1000)
+            else:
+                del self._limits[session, key]
+        if pending is not None:
+            session.submit(self._execute, pending)
+
+    def _execute(self, call):
+        args, kwargs = call
+        self.executions += 1
+        self.f(*args, **kwargs)
 
 
 def throttle(**kwargs):
     return functools.partial(_Throttler, **kwargs)
 
 
+def debounce(**kwargs):
+    return functools.partial(_Throttler, debounce=True, **kwargs)
+
+
+class _TimerWheel:
+    """Hashed timer wheel running the timers of an IOLoop with a single
+    timeout, set for the next tick having timers due"""
+
+    _wheels = weakref.WeakKeyDictionary()
+    _wheels_lock = threading.Lock()
+
+    def __init__(self, loop, resolution=0.005, size=512):
+        # Weak, so that the wheel does not keep its entry in _wheels alive
+        self._loop = weakref.ref(loop)
+        self._resolution = resolution
+        self._slots = [[] for _ in range(size)]
+        self._lock = threading.Lock()
+        self._tick = math.floor(time.monotonic() / resolution)   # Next tick to run
+        # Only used on the IOLoop
+        self._handle = None
+        self._wake_tick = None
+
+    @classmethod
+    def get(cls, loop):
+        with cls._wheels_lock:
+            if loop not in cls._wheels:
+                cls._wheels[loop] = cls(loop)
+            return cls._wheels[loop]
+
+    def add(self, due, callback, *args):
+        """Runs callback(*args) on the IOLoop at the time.monotonic() due"""
+        with self._lock:
+            tick = max(math.ceil(due / self._resolution), self._tick)
+            self._slots[tick % len(self._slots)].append((tick, callback, args))
+        self._loop().add_callback(self._wake, tick)
+
+    def _wake(self, tick):
+        if self._wake_tick is not None and self._wake_tick <= tick:
+            return
+        loop = self._loop()
+        if self._handle is not None:
+            loop.remove_timeout(self._handle)
+        self._wake_tick = tick
+        self._handle = loop.call_later(max(0, tick * self._resolution - time.monotonic()),
+                                       self._run)
+
+    def _run(self):
+        self._handle = self._wake_tick = None
+        now = math.floor(time.monotonic() / self._resolution)
+        size = len(self._slots)
+        fired = []
+        with self._lock:
+            for tick in range(max(self._tick, now - size + 1), now + 1):
+                slot = self._slots[tick % size]
+                if slot:
+                    fired.extend(timer for timer in slot if timer[0] <= now)
+                    slot[:] = [timer for timer in slot if timer[0] > now]
+            self._tick = now + 1
+            # Next tick with timers due, or one more turn of the wheel
+            next_tick = None
+            if any(self._slots):
+                next_tick = now + size
+                for tick in range(now + 1, now + size + 1):
+                    if any(timer[0] == tick for timer in self._slots[tick % size]):
+                        next_tick = tick
+                        break
+        if next_tick is not None:
+            self._wake(next_tick)
+        for _, callback, args in fired:
+            try:
+                callback(*args)
+            except:
+                import traceback
+                traceback.print_exc()
+
+
 class PeriodicScheduler(Component):
-    def init(self, f, ms, reload=False):
+    """Calls f every ms milliseconds at a fixed rate. Ticks missed because f
+    took too long are skipped, or run late to catch up if not skip."""
+
+    def init(self, f, ms, reload=False, skip=True):
         self._f = f
-        self._dt = datetime.timedelta(milliseconds=ms)
-        self._handle = None
+        self._period = ms / 1000
+        self._skip = skip
+        # Pending ticks of previous generations are ignored when they fire,
+        # which can be decided from any thread
+        self._generation = 0
         self._cleared = False
+        self._due = None
+        self._stats = {"ticks": 0, "skipped": 0, "overruns": 0,
+                       "max_lateness_ms": 0., "total_lateness_ms": 0.}
         self.reload = reload
 
-    def do(self):
+    @property
+    def stats(self):
+        stats = dict(self._stats)
+        stats["mean_lateness_ms"] = stats["total_lateness_ms"] / max(1, stats["ticks"])
+        return stats
+
+    def _schedule(self, generation):
+        _TimerWheel.get(self._session._loop).add(self._due, self.do, generation)
+
+    def do(self, generation):
+        if generation != self._generation: return
         if self._cleared or self._session.closed: return
-        with self._session:
-            self._f()
-        self._handle = tornado.ioloop.IOLoop.current().add_timeout(self._dt, self.do)
+        self._session.submit(self._tick, generation)
+
+    def _tick(self, generation):
+        if generation != self._generation or self._cleared: return
+        start = time.monotonic()
+        lateness = (start - self._due) * 1000
+        self._stats["ticks"] += 1
+        self._stats["total_lateness_ms"] += lateness
+        self._stats["max_lateness_ms"] = max(self._stats["max_lateness_ms"], lateness)
+        self._f()
+        end = time.monotonic()
+        if end - start > self._period:
+            self._stats["overruns"] += 1
+        # The next tick is relative to the schedule, not to the end of f
+        self._due += self._period
+        if self._skip and end > self._due:
+            missed = math.ceil((end - self._due) / self._period)
+            self._stats["skipped"] += missed
+            self._due += missed * self._period
+        self._schedule(generation)
 
     def start(self):
         self._cleared = False
-        self._handle = tornado.ioloop.IOLoop.current().add_timeout(self._dt, self.do)
+        self._generation += 1
+        self._due = time.monotonic() + self._period
+        self._schedule(self._generation)
         return self
 
     def clear(self):
         self._cleared = True
-        if self._handle is not None:
-            tornado.ioloop.IOLoop.current().remove_timeout(self._handle)
+        self._generation += 1
 
     def reset(self):
-        if self._handle is not None:
-            tornado.ioloop.IOLoop.current().remove_timeout(self._handle)
         self.start()
 
     __view__ = JSClass('''
@@ -9,10 +9,11 @@ setup(
     url="https://github.com/ispgroupucl/pyplet",
     license='LGPL',
     version="0.1.1",
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     description="A library for creating small web applications with Python alone",
     long_description_content_type="text/markdown",
     packages=find_packages(include=("pyplet",)),
-    install_requires=["tornado", "matplotlib"],
+    install_requires=["tornado>=6,<7", "matplotlib"],
+    extras_require={"msgpack": ["msgpack"]},
 )
 
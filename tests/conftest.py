@@ -0,0 +1,50 @@
+"""Helpers shared by the tests, and the benchmarks"""
+from pyplet.primitives import Component, JSClass, Session
+import asyncio
+
+
+class FakeSocket:
+    """Keeps the frames written to it"""
+
+    def __init__(self):
+        self.frames = []
+
+    def write_message(self, frame, binary=False):
+        self.frames.append(frame)
+
+
+class NullSocket:
+    def write_message(self, frame, binary=False):
+        pass
+
+
+class SlowSocket(FakeSocket):
+    """Client that does not drain the last frame written until its future is set"""
+    closed = False
+
+    def write_message(self, frame, binary=False):
+        super().write_message(frame, binary)
+        self.future = asyncio.get_running_loop().create_future()
+        return self.future
+
+    def close(self):
+        self.closed = True
+
+
+class Dummy(Component):
+    def init(self, value=0, items=()):
+        self.value = value
+        self.items = list(items)
+
+    __view__ = JSClass("class DummyView {}")
+
+
+def run_session(f):
+    """Calls f(session) on a running loop, returns the socket once its frames are flushed"""
+    async def main():
+        socket = FakeSocket()
+        session = Session(0, socket)
+        f(session)
+        await asyncio.sleep(0)
+        return socket
+    return asyncio.run(main())
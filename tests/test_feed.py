@@ -0,0 +1,130 @@
+from pyplet.feed import _collapse_carriage_returns
+from conftest import NullSocket
+
+
+def test_collapse_carriage_returns():
+    assert _collapse_carriage_returns("10%\r20%\r30%\ndone\n") == "\r30%\ndone\n"
+    assert _collapse_carriage_returns("a\nb\rc\r\nd") == "a\nc\nd"
+    assert _collapse_carriage_returns("plain\n") == "plain\n"
+
+
+def test_encode_image_codecs():
+    from pyplet.feed import encode_image, img_to_rgba
+    import numpy as np
+    rgba = img_to_rgba(np.arange(64*64).reshape(64, 64) % 256)
+    assert encode_image(rgba, "jpeg:80").mime == "image/jpeg"
+    assert encode_image(rgba, "png:1").data.startswith(b"\x89PNG")
+    assert encode_image(rgba, "webp").mime in ("image/webp", "image/jpeg")
+
+
+def test_encode_cache_key():
+    from pyplet.feed import _EncodeCache
+    import numpy as np
+    image = np.zeros((8, 8))
+    assert _EncodeCache.key(image, "png") == _EncodeCache.key(image.copy(), "png")
+    image[0, 0] = 1
+    assert _EncodeCache.key(image, "png") != _EncodeCache.key(np.zeros((8, 8)), "png")
+
+
+def test_encode_cache_bytes():
+    from pyplet.feed import _EncodeCache
+    from pyplet.primitives import Blob
+    cache = _EncodeCache(maxbytes=100)
+    for key in "abc":
+        cache.put(key, Blob(b"x" * 40, "image/png"))
+    assert cache.get("a") is None and cache.get("b") is not None
+    cache.put("d", Blob(b"x" * 101, "image/png"))
+    assert cache.get("d") is None
+    # Replacing an entry drops its bytes, used ones are dropped last
+    cache.put("c", Blob(b"x" * 20, "image/png"))
+    cache.put("e", Blob(b"x" * 40, "image/png"))
+    assert cache.get("b") is not None and cache.get("c") is not None and cache.get("e") is not None
+    assert cache.nbytes == 100
+
+
+def test_img_to_rgba_into_buffer():
+    from pyplet.feed import img_to_rgba
+    import numpy as np
+    out = np.empty((2, 3, 3), np.uint8)
+    image = np.array([[0, 0.5, 2], [-1, 1, 0.1]])
+    assert img_to_rgba(image, scale=255, out=out, alpha=False) is out
+    assert out[..., 0].tolist() == [[0, 127, 255], [0, 255, 25]]
+    assert (out[..., 0] == out[..., 2]).all()
+    assert img_to_rgba(np.zeros((3, 2, 3), np.uint8), CHW=True)[..., 3].min() == 255
+
+
+def test_img_to_rgba_layouts():
+    from pyplet.feed import img_to_rgba
+    import numpy as np
+    hwc = np.random.default_rng(0).random((5, 7, 3))
+    expected = np.concatenate([np.clip(hwc * 255, 0, 255).astype(np.uint8),
+                               np.full((5, 7, 1), 255, np.uint8)], axis=-1)
+    assert (img_to_rgba(hwc, scale=255) == expected).all()
+    assert (img_to_rgba(np.moveaxis(hwc, 2, 0).copy(), scale=255, CHW=True) == expected).all()
+    assert (img_to_rgba(expected[..., :3]) == expected).all()
+    assert (img_to_rgba(expected[..., 0])[..., :3] == expected[..., :1]).all()
+
+
+def test_block_image_into_image():
+    from pyplet.primitives import Session, Blob
+    from pyplet.feed import Block
+    from pyplet.widgets import Image
+    import numpy as np
+
+    with Session(0, NullSocket()):
+        img = Image()
+        Block().image(np.zeros((4, 4)), img=img)
+    assert isinstance(img.src, Blob)
+
+
+def test_block_max_entries():
+    from pyplet.primitives import Session
+    from pyplet.feed import Block
+
+    with Session(0, NullSocket()):
+        block = Block(max_entries=10)
+        changes = []
+        block.on_change(lambda events: changes.append(events), trigger=False)
+        for i in range(25):
+            block.append("<p>{}</p>".format(i % 2))
+    assert len(block.content) <= 10 and block.content[-1] == {"html": "<p>0</p>"}
+    # Evictions drop the head explicitly, whatever its content
+    assert {"content__drop", "content"} in changes
+    assert block._sent["content"] == block.content
+
+    with Session(0, NullSocket()):
+        block = Block(max_bytes=100)
+        for i in range(20):
+            block.append("x" * 30)
+    assert len(block.content) <= 3 and block._bytes == 30 * len(block.content)
+
+
+def test_pyplot_figures_per_session():
+    from pyplet.primitives import Session
+    from pyplet.feed import Block
+    from matplotlib import pyplot as plt
+    import threading
+
+    barrier = threading.Barrier(2)
+    figures = {}
+
+    def plot(block, name):
+        with block.enter():
+            barrier.wait()
+            plt.figure()
+            plt.plot([1, 2])
+            barrier.wait()
+            figures[name] = (plt.gcf(), plt.get_fignums())
+            plt.close()
+
+    blocks = []
+    for _ in range(2):
+        with Session(0, NullSocket()):
+            blocks.append(Block())
+    threads = [threading.Thread(target=plot, args=(block, name)) for block, name in zip(blocks, "ab")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert figures["a"][0] is not figures["b"][0]
+    assert figures["a"][1] == figures["b"][1] == [1]
@@ -0,0 +1,308 @@
+from pyplet.primitives import Session
+from conftest import FakeSocket, SlowSocket, Dummy, run_session
+import subprocess
+import asyncio
+import shutil
+import base64
+import pytest
+import json
+
+
+def test_messages_coalesced():
+    def f(session):
+        for i in range(3):
+            session.write_message(json.dumps({"type": "delete", "comp_id": i}))
+    socket = run_session(f)
+    assert len(socket.frames) == 1
+    assert [m["comp_id"] for m in json.loads(socket.frames[0])] == [0, 1, 2]
+
+
+def test_collected_component_with_outbox_locked():
+    import gc
+
+    def f(session):
+        with session:
+            dummy = Dummy()
+            dummy._self = dummy                        # Only freed by the collector
+        del dummy
+        with session._outbox_lock:
+            gc.collect()                               # Deadlocked with a plain Lock
+    socket = run_session(f)
+    assert {"type": "delete", "comp_id": 1} in json.loads(socket.frames[-1])
+
+
+def test_single_message_not_wrapped():
+    socket = run_session(lambda session: session.write_message('{"type": "delete", "comp_id": 0}'))
+    assert json.loads(socket.frames[0]) == {"type": "delete", "comp_id": 0}
+
+
+def test_binary_frames_keep_order():
+    def f(session):
+        session.write_message('{"type": "delete", "comp_id": 0}')
+        session.write_binary({"comp_id": 1, "field": "src", "mime": "image/png"}, b"data")
+        session.write_message('{"type": "delete", "comp_id": 2}')
+    socket = run_session(f)
+    assert len(socket.frames) == 3
+    assert isinstance(socket.frames[1], bytes) and socket.frames[1].endswith(b"data")
+
+
+def test_packed_messages():
+    msgpack = pytest.importorskip("msgpack")
+
+    def f(session):
+        session.packed = True
+        session.write_message(session.encode({"type": "delete", "comp_id": 0}))
+        session.write_binary({"comp_id": 1, "field": "src", "mime": "image/png"}, b"data")
+    socket = run_session(f)
+    assert len(socket.frames) == 1
+    delete, blob = msgpack.unpackb(socket.frames[0], raw=False)
+    assert delete == {"type": "delete", "comp_id": 0}
+    assert blob["type"] == "blob" and blob["data"] == b"data"
+
+
+_JS_HARNESS = """
+globalThis.window = {}
+globalThis.document = {getElementsByTagName: () => [{}]}
+globalThis.URL = {createObjectURL: (blob) => "blob:" + blob.type + ":" + blob.size, revokeObjectURL() {}}
+globalThis.WebSocket = class { constructor() { this.protocol = "pyplet.json" } }
+%s
+let session = new JSSession("ws://localhost/websocket/app.py")
+let received = []
+session.on_message = (message) => received.push(message)
+for (let frame of JSON.parse(process.argv[2])) {
+    let data = Buffer.from(frame, "base64")
+    session.ws.onmessage({data: data.buffer.slice(data.byteOffset, data.byteOffset + data.length)})
+}
+console.log(JSON.stringify(received))
+"""
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="requires node")
+def test_js_session_json_blobs(tmp_path):
+    from pyplet.primitives import JSSession
+    socket = run_session(lambda session: session.write_binary({"comp_id": 3, "field": "src", "mime": "image/png"},
+                                                              b"\x89PNG"))
+    assert isinstance(socket.frames[0], bytes)
+    script = tmp_path / "session.js"
+    script.write_text(_JS_HARNESS % JSSession.defn)
+    frames = json.dumps([base64.b64encode(frame).decode() for frame in socket.frames])
+    output = subprocess.run(["node", str(script), frames], capture_output=True, text=True, check=True).stdout
+    assert json.loads(output) == [{"type": "state_change", "comp_id": 3, "state_change": {"src": "blob:image/png:4"}}]
+
+
+def test_sequential_component_ids():
+    from pyplet.widgets import Image
+
+    def f(session):
+        with session:
+            assert [Image()._id for _ in range(3)] == [1, 2, 3]
+    run_session(f)
+
+
+def test_sessions_enter_concurrently():
+    import threading
+
+    def f(session):
+        other = Session(1, FakeSocket())
+        entered, release = threading.Event(), threading.Event()
+        def hold():
+            with other:
+                assert Session.current() is other
+                entered.set()
+                release.wait(5)
+        thread = threading.Thread(target=hold)
+        thread.start()
+        assert entered.wait(5)
+        with session:
+            assert Session.current() is session
+        release.set()
+        thread.join()
+        assert Session.current() is None
+    run_session(f)
+
+
+def test_submit_keeps_session_order():
+    import concurrent.futures
+    executor = concurrent.futures.ThreadPoolExecutor(4)
+    session = Session(0, FakeSocket(), executor=executor)
+    done = []
+    for i in range(50):
+        session.submit(done.append, i)
+    executor.shutdown(wait=True)
+    assert done == list(range(50))
+
+
+def _apply_patch(value, ops):
+    import copy
+    value = copy.deepcopy(value)
+    for op, path, arg in ops:
+        parent = value
+        for key in path[:-1]:
+            parent = parent[key]
+        key = path[-1]
+        if op == "replace":
+            parent[key] = arg
+        elif op == "insert":
+            parent[key:key] = arg
+        elif isinstance(parent, list):
+            del parent[key:key+arg]
+        else:
+            del parent[key]
+    return value
+
+
+def test_compute_patch():
+    from pyplet.primitives import compute_patch
+    cases = [
+        ([1, 2, 3], [1, 2, 3]),
+        ([1, 2, 3], [1, 4, 3]),
+        ([1], [1, 1]),
+        ([1, 1], [1]),
+        ([1, 2, 3, 4], [1, 5, 6, 7, 4]),
+        ([], [1, 2]),
+        ([[{"name": "a"}, {"name": "b"}]], [[{"name": "a"}, {"name": "c"}]]),
+        ({"a": 1, "b": [1, 2]}, {"b": [1, 2, 3], "c": 2}),
+    ]
+    for old, new in cases:
+        assert _apply_patch(old, compute_patch(old, new)) == new
+    assert compute_patch([1, 2, 3], [1, 2, 3]) == []
+    assert compute_patch(list(range(10)), [*range(5), 42, *range(5, 10)]) == [["insert", [5], [42]]]
+    assert compute_patch(list(range(10)), list(range(3, 12))) == [["delete", [0], 3], ["insert", [7], [10, 11]]]
+    assert _apply_patch([1, 2, 3], compute_patch([1, 2, 3], [3, 4])) == [3, 4]
+    assert compute_patch([0, 0, 0, 1], [0, 1, 2]) == [["delete", [0], 2], ["insert", [2], [2]]]
+
+
+def test_transaction_merges_updates():
+    events = []
+    def f(session):
+        with session:
+            a, b = Dummy(), Dummy()
+            a.on_change(events.append, "value", trigger=False)
+        session.flush()
+        with session.transaction():
+            for i in range(5):
+                a.value = i
+                b.items__append = i
+            b.items__remove = 0
+        assert a.value == 4 and b.items == [1, 2, 3, 4]
+    socket = run_session(f)
+    messages = json.loads(socket.frames[-1])
+    assert [m["state_change"] for m in messages[:1]] == [{"value": 4}]
+    assert messages[1]["state_patch"] == {"items": [["insert", [0], [1, 2, 3, 4]]]}
+    assert events == [{"value"}]
+
+
+def test_transaction_listener_updates():
+    def f(session):
+        with session:
+            a, b = Dummy(), Dummy()
+            # Notified before b, then after it in a new round
+            a.on_change(lambda events: setattr(b, "items", [b.value]), "value", trigger=False)
+            b.on_change(lambda events: setattr(a, "items", [a.value * 2]), "value", trigger=False)
+        session.flush()
+        with session.transaction():
+            a.value = 1
+            b.value = 2
+        assert a.items == [2] and b.items == [2]
+        assert a._batch is None and b._batch is None
+    socket = run_session(f)
+    messages = json.loads(socket.frames[-1])
+    assert {m["comp_id"] for m in messages if m["type"] == "state_change"} == {1, 2}
+
+
+def test_transaction_honors_flags():
+    events = []
+    def f(session):
+        with session:
+            a, b = Dummy(), Dummy()
+            a.on_change(events.append, trigger=False)
+            b.on_change(events.append, trigger=False)
+        session.flush()
+        with session.transaction():
+            a.value = 1
+            a.update(value=2, _send_frontend=False)
+            with b.batch(_trigger_listeners=False):
+                b.value = 3
+        assert a.value == 2 and b.value == 3
+    socket = run_session(f)
+    messages = json.loads(socket.frames[-1])
+    assert [m for m in messages if m["type"] == "state_change"] == [
+        {"type": "state_change", "comp_id": 2, "state_change": {"value": 3}}]
+    assert events == [{"value"}]
+
+
+def test_backed_up_session_conflates_state_changes():
+    async def main():
+        socket = SlowSocket()
+        session = Session(0, socket, high_water=10, max_pending=1000)
+        session.write_message('{"type": "delete", "comp_id": 0}')
+        await asyncio.sleep(0)
+        assert len(socket.frames) == 1
+        for i in range(5):
+            session.write_message('{"value": %d}' % i, conflate=("state", 1, frozenset(["value"])))
+            session.write_message('{"type": "new", "comp_id": %d}' % i)
+        await asyncio.sleep(0)
+        assert len(socket.frames) == 1 and session.conflated == 4
+        socket.future.set_result(None)
+        await asyncio.sleep(0)
+        messages = json.loads(socket.frames[-1])
+        assert [m.get("value") for m in messages] == [None] * 4 + [4, None]
+        session.write_message("x" * 2000)
+        assert session.closed and session.dropped == 1
+        await asyncio.sleep(0)
+        assert socket.closed
+    asyncio.run(main())
+
+
+def test_backed_up_session_keeps_patched_values():
+    async def main():
+        socket = SlowSocket()
+        session = Session(0, socket, high_water=10)
+        with session:
+            dummy = Dummy()
+        await asyncio.sleep(0)
+        with session:
+            dummy.items = None                         # Replaced by the next full value
+            dummy.items = [[i] for i in range(10)]
+            dummy.items = [*dummy.items[:9], [99]]     # Sent as a patch
+            dummy.items = []
+        socket.future.set_result(None)
+        await asyncio.sleep(0)
+        messages = json.loads(socket.frames[-1])
+        assert len(messages) == 3 and session.conflated == 1
+        assert messages[1]["state_patch"] == {"items": [["replace", [9, 0], 99]]}
+    asyncio.run(main())
+
+
+def test_profiled_listeners():
+    from pyplet.widgets import Slider
+    from pyplet.profiler import ProfileReport
+
+    def f(session):
+        with session:
+            report = ProfileReport()
+            slider = Slider(value=0)
+            slider.on_change(lambda state_change: sum(range(1000)), "value", trigger=False)
+            slider.value = 1
+            slider.value = 2
+            report.refresh()
+            component, fields, callback, calls = report.callbacks[0][:4]
+            assert (component, fields, calls) == ("Slider", "value", 2)
+            assert callback.endswith("<lambda>")
+            assert any("sum" in row[0] for row in report.functions)
+    run_session(f)
+
+
+def test_component_footprint():
+    from pyplet.widgets import Image
+
+    def f(session):
+        with session:
+            image = Image()
+            assert image._listeners == () and image._sent is None
+            image.on_change(print, "src", trigger=False)
+            assert vars(image) == {}
+            image._extra = 1                           # Subclasses keep a __dict__
+            assert vars(image) == {"_extra": 1}
+            assert not hasattr(image, "set_image")
+    run_session(f)
@@ -0,0 +1,125 @@
+from pyplet.server import compile_app, make_app, view_bundle, listen
+from pyplet.primitives import JSSession
+from pyplet import metrics
+import tornado.websocket
+import tornado.testing
+import argparse
+import os
+
+
+def test_compile_app_cached(tmp_path):
+    path = str(tmp_path / "app_test.py")
+    with open(path, "w") as file:
+        file.write("x = 1\n")
+    code = compile_app(path)
+    assert compile_app(path) is code
+    with open(path, "w") as file:
+        file.write("x = 22\n")
+    os.utime(path, ns=(0, 0))
+    env = {}
+    exec(compile_app(path), env)
+    assert env["x"] == 22
+
+
+def test_listen_workers(monkeypatch):
+    import tornado.process
+    import asyncio
+
+    async def main():
+        config = argparse.Namespace(apps="*/app_*.py", top_bar=0, debug=0, workers=1, port=0, host="127.0.0.1")
+        server, worker = listen(config)
+        assert worker is None
+        server.stop()
+        monkeypatch.setattr(tornado.process, "fork_processes", lambda n: n - 1)
+        config.workers, config.debug = 4, 1
+        server, worker = listen(config)
+        assert worker == 3 and not server.request_callback.settings["debug"]
+        server.stop()
+    asyncio.run(main())
+
+
+class TestHandlers(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        config = argparse.Namespace(apps="*/app_*.py", top_bar=0, debug=False)
+        return make_app(config)
+
+    def test_cached_bundle(self):
+        version = view_bundle().version
+        page = self.fetch("/").body.decode()
+        assert "/bundle/{}.js".format(version) in page
+        response = self.fetch("/bundle/{}.js".format(version), headers={"Accept-Encoding": "gzip"},
+                              decompress_response=False)
+        assert response.code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert "immutable" in response.headers["Cache-Control"]
+        response = self.fetch("/bundle/{}.js".format(version),
+                              headers={"If-None-Match": response.headers["Etag"]})
+        assert response.code == 304
+        assert self.fetch("/bundle/0123456789abcdef.js").code == 404
+
+    def test_bundle_defines_views(self):
+        source = view_bundle().source
+        assert 'pyplet_classes["pyplet.feed.Feed.FeedView"]' in source
+        assert JSSession.ref not in source
+
+    def test_metrics(self):
+        metrics.listener_seconds.observe(0.002, "on_click")
+        response = self.fetch("/metrics")
+        assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        body = response.body.decode()
+        assert "# TYPE pyplet_sessions gauge" in body
+        assert 'pyplet_listener_seconds_bucket{listener="on_click",le="0.001"} 0' in body
+        assert 'pyplet_listener_seconds_bucket{listener="on_click",le="0.005"} 1' in body
+
+
+class TestCompression(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        config = argparse.Namespace(apps="*/app_*.py", top_bar=0, debug=False,
+                                    compression_level=6, compression_min_size=256)
+        return make_app(config)
+
+    @tornado.testing.gen_test
+    async def test_small_frames_uncompressed(self):
+        url = self.get_url("/websocket/missing.py").replace("http", "ws", 1)
+        client = await tornado.websocket.websocket_connect(url, compression_options={})
+        await client.read_message()
+        handler, = [rule.target for rule in self._app.wildcard_router.rules
+                    if getattr(rule.target, "__name__", "") == "SocketHandler"]
+        socket, = handler.instances.values()
+        assert socket.ws_connection._compressor is not None
+        session = socket.session
+        for message, compressed in [("a" * 100, False), ("a" * 1000, True)]:
+            raw, wire = session.raw_bytes, session.wire_bytes
+            await socket.write_message(message)
+            assert await client.read_message() == message
+            assert session.raw_bytes - raw == len(message)
+            framed = session.wire_bytes - wire
+            assert framed < len(message) if compressed else framed == len(message) + 2
+        client.close()
+
+    @tornado.testing.gen_test
+    async def test_without_tornado_internals(self):
+        url = self.get_url("/websocket/missing.py").replace("http", "ws", 1)
+        client = await tornado.websocket.websocket_connect(url, compression_options={})
+        await client.read_message()
+        handler, = [rule.target for rule in self._app.wildcard_router.rules
+                    if getattr(rule.target, "__name__", "") == "SocketHandler"]
+        socket, = handler.instances.values()
+
+        class Connection:
+            """Hides the internals that other tornado versions may not have"""
+            def __init__(self, connection):
+                self.__connection = connection
+
+            def __getattr__(self, name):
+                if name in ("_compressor", "_message_bytes_out", "_wire_bytes_out"):
+                    raise AttributeError(name)
+                return getattr(self.__connection, name)
+
+        socket.ws_connection = Connection(socket.ws_connection)
+        session = socket.session
+        raw, wire = session.raw_bytes, session.wire_bytes
+        await socket.write_message("é" * 100)
+        assert await client.read_message() == "é" * 100
+        assert session.raw_bytes - raw == session.wire_bytes - wire == 200
+        client.close()
@@ -0,0 +1,35 @@
+from pyplet.tiles import _Pyramid
+import numpy as np
+
+
+def test_pyramid_levels_and_tiles():
+    image = np.arange(40*24, dtype=np.float64).reshape(40, 24) % 256
+    pyramid = _Pyramid(image, alpha=False)
+    assert pyramid.n_levels(8) == 4
+    assert pyramid.tile(0, 1, 2, 8).shape == (8, 8, 3)
+    assert pyramid.tile(0, 2, 4, 8)[..., 0].tolist() == image[32:40, 16:24].astype(np.uint8).tolist()
+    level1 = pyramid.region(1, 0, 20, 0, 12)[..., 0].astype(float)
+    expected = (image[0::2, 0::2] + image[1::2, 0::2] + image[0::2, 1::2] + image[1::2, 1::2] + 2) // 4
+    assert np.abs(level1 - expected).max() <= 1
+    assert pyramid.tile(3, 0, 0, 8).shape == (5, 3, 3)
+
+
+def test_pyramid_coarse_tile_from_source():
+    image = np.random.default_rng(0).integers(0, 256, (3, 64, 48)).astype(np.uint8)
+    pyramid = _Pyramid(image, CHW=True, alpha=False)
+    tile = pyramid.tile(2, 1, 1, 8).astype(int)
+    source = np.moveaxis(image, 0, 2)[32:64, 32:48].astype(int)
+    expected = (source[0::4, 0::4] + source[2::4, 0::4] + source[0::4, 2::4] + source[2::4, 2::4] + 2) // 4
+    assert tile.tolist() == expected.tolist()
+
+
+def test_dirty_rects():
+    from pyplet.tiles import dirty_rects
+    old = np.zeros((100, 70, 3), np.uint8)
+    new = old.copy()
+    assert dirty_rects(old, new, 32) == ([], 0)
+    new[5, 5] = new[40, 10] = 1
+    new[99, 69] = 1
+    rects, ratio = dirty_rects(old, new, 32)
+    assert sorted(rects) == [(0, 0, 32, 64), (64, 96, 6, 4)]
+    assert ratio == 3 / 12
@@ -0,0 +1,31 @@
+from pyplet import vendor
+import io
+import os
+
+
+def test_tags_and_integrity():
+    assert all(asset.url.startswith("https://") for asset in vendor.ASSETS + vendor.THEME_IMAGES)
+    asset = vendor.Asset("a.js", "https://example.org/a.js", vendor.integrity(b"a"))
+    assert vendor.tag(asset) == '<script src="https://example.org/a.js" integrity="{}" crossorigin="anonymous"></script>'.format(asset.integrity)
+    assert vendor.tag(asset, "/vendor/a.js") == '<script src="/vendor/a.js"></script>'
+    vendor.check_integrity(asset, b"a")
+    try:
+        vendor.check_integrity(asset, b"b")
+    except ValueError:
+        pass
+    else:
+        assert False, "tampered asset accepted"
+
+
+def test_fetch(tmp_path, monkeypatch):
+    urls = []
+    def urlopen(url):
+        urls.append(url)
+        return io.BytesIO(url.encode())
+    monkeypatch.setattr(vendor, "ASSETS", [vendor.Asset("a.css", "https://example.org/a.css", None)])
+    monkeypatch.setattr(vendor.urllib.request, "urlopen", urlopen)
+    assert vendor.missing(str(tmp_path)) == ["a.css"] + [image.name for image in vendor.THEME_IMAGES]
+    vendor.fetch(str(tmp_path))
+    assert vendor.missing(str(tmp_path)) == []
+    assert all(url.startswith("https://") for url in urls)
+    assert os.path.isfile(os.path.join(str(tmp_path), "images", "ui-icons_444444_256x240.png"))
@@ -0,0 +1,148 @@
+from pyplet.primitives import Session
+from pyplet.widgets import throttle, debounce
+from conftest import NullSocket
+import asyncio
+
+
+def run_calls(limited, calls, wait=0.1):
+    """Calls limited(*args) every dt seconds, within a session"""
+    async def main():
+        session = Session(0, NullSocket())
+        for dt, *args in calls:
+            await asyncio.sleep(dt)
+            with session:
+                limited(*args)
+        await asyncio.sleep(wait)
+    asyncio.run(main())
+
+
+def test_throttle_trailing_keeps_latest():
+    done = []
+    @throttle(ms=30)
+    def f(x):
+        done.append(x)
+    run_calls(f, [(0, i) for i in range(5)])
+    assert done == [4]
+    assert f.stats == {"calls": 5, "executions": 1, "superseded": 4}
+
+
+def test_throttle_leading_and_trailing():
+    done = []
+    f = throttle(ms=30, leading=True)(done.append)
+    run_calls(f, [(0, i) for i in range(5)])
+    assert done == [0, 4]
+
+
+def test_debounce_max_wait():
+    done = []
+    f = debounce(ms=30, max_wait=60)(done.append)
+    run_calls(f, [(0.01, i) for i in range(10)])
+    assert done[0] < 9 and done[-1] == 9
+
+
+def test_throttle_per_key():
+    done = []
+    f = throttle(ms=30, key=lambda x: x % 2)(done.append)
+    run_calls(f, [(0, i) for i in range(6)])
+    assert sorted(done) == [4, 5]
+
+
+class FakeLoop:
+    """IOLoop running its callbacks and timeouts on a fake clock, when driven by run_until"""
+
+    def __init__(self, now=1000.):
+        self.now = now
+        self.callbacks = []
+        self.timeouts = {}
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def add_callback(self, callback, *args):
+        self.callbacks.append((callback, args))
+
+    def call_later(self, delay, callback):
+        handle = object()
+        self.timeouts[handle] = (self.now + delay, callback)
+        return handle
+
+    def remove_timeout(self, handle):
+        self.timeouts.pop(handle, None)
+
+    def run_until(self, end):
+        while True:
+            while self.callbacks:
+                callback, args = self.callbacks.pop(0)
+                callback(*args)
+            if not self.timeouts: break
+            handle = min(self.timeouts, key=lambda handle: self.timeouts[handle][0])
+            due, callback = self.timeouts[handle]
+            if due > end: break
+            del self.timeouts[handle]
+            self.now = max(self.now, due)
+            callback()
+        self.now = max(self.now, end)
+
+
+def run_scheduler(monkeypatch, f, ms, duration, **kwargs):
+    """Runs a PeriodicScheduler calling f(loop) for duration seconds of a fake clock"""
+    from pyplet import widgets
+    loop = FakeLoop()
+    monkeypatch.setattr(widgets, "time", loop)
+    async def main():
+        session = Session(0, NullSocket())
+        session._loop = loop
+        with session:
+            scheduler = widgets.PeriodicScheduler(f=lambda: f(loop), ms=ms, **kwargs).start()
+        start = loop.now
+        loop.run_until(start + duration)
+        with session:
+            scheduler.clear()
+        loop.run_until(loop.now + 1)
+        return start, scheduler.stats
+    return asyncio.run(main())
+
+
+def test_periodic_scheduler_fixed_rate(monkeypatch):
+    ticks = []
+    def f(loop):
+        ticks.append(loop.now)
+        # A slow tick does not shift the ones after it
+        if len(ticks) == 3:
+            loop.sleep(0.012)
+    start, stats = run_scheduler(monkeypatch, f, ms=20, duration=0.23)
+    assert len(ticks) == stats["ticks"] == 11
+    # Timers fire on the wheel's 5 ms ticks, the first one at or after they are due
+    for i, tick in enumerate(ticks):
+        assert 0 <= tick - (start + 0.02 * (i + 1)) < 0.005
+    assert stats["skipped"] == stats["overruns"] == 0
+
+
+def test_periodic_scheduler_skips_missed_ticks(monkeypatch):
+    ticks = []
+    def f(loop):
+        ticks.append(loop.now)
+        loop.sleep(0.045)
+    start, stats = run_scheduler(monkeypatch, f, ms=20, duration=0.15)
+    # Ticks at 20, 80 and 140 ms, the ones due while f was running being skipped
+    assert len(ticks) == stats["ticks"] == stats["overruns"] == 3
+    assert stats["skipped"] == 2 * stats["ticks"]
+    for tick, due in zip(ticks, [0.02, 0.08, 0.14]):
+        assert 0 <= tick - (start + due) < 0.005
+
+
+def test_timer_wheel_released_with_its_loop():
+    from pyplet.widgets import _TimerWheel
+    import weakref
+    import gc
+    loop = FakeLoop()
+    wheel = _TimerWheel.get(loop)
+    wheel.add(loop.now + 1, print)
+    assert _TimerWheel.get(loop) is wheel
+    wheel = weakref.ref(wheel)
+    del loop
+    gc.collect()
+    assert wheel() is None